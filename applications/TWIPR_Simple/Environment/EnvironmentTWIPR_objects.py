@@ -13,7 +13,7 @@ from numpy import nan
 from scioi_py_core import core as core
 from scioi_py_core.core import spaces as sp
 from scioi_py_core.utils import lib_control
-from scioi_py_core.utils.orientations import twiprToRotMat, twiprFromRotMat
+from scioi_py_core.utils.orientations import twiprToRotMat, twiprFromRotMat, twiprToQuat, twiprFromQuat
 from scioi_py_core.utils.babylon import setBabylonSettings
 
 # === DEFINITIONS ======================================================================================================
@@ -198,6 +198,9 @@ class Space3D_TWIPR(core.spaces.Space):
     def _add(self, state1, state2, new_state):
         raise Exception("Addition not allowed")
 
+    def _addBatch(self, values1, values2):
+        raise Exception("Addition not allowed")
+
 
 class Mapping_TWIPR_2_3D(core.spaces.SpaceMapping):
     space_to = core.spaces.Space3D
@@ -210,6 +213,14 @@ class Mapping_TWIPR_2_3D(core.spaces.SpaceMapping):
         }
         return out
 
+    def _mapBatch(self, batch):
+        pos = batch['pos']
+        out = {
+            'pos': np.column_stack((pos[:, 0], pos[:, 1], np.zeros(len(batch)))),
+            'ori': twiprToRotMat(batch['theta'], batch['psi'])
+        }
+        return out
+
 
 class Mapping_3D_2_TWIPR(core.spaces.SpaceMapping):
     space_from = core.spaces.Space3D
@@ -224,9 +235,62 @@ class Mapping_3D_2_TWIPR(core.spaces.SpaceMapping):
         }
         return out
 
+    def _mapBatch(self, batch):
+        angles = twiprFromRotMat(batch['ori'])
+        out = {
+            'pos': batch['pos'][:, 0:2],
+            'theta': angles[1],
+            'psi': angles[0]
+        }
+        return out
+
+
+class Mapping_TWIPR_2_3DQuat(core.spaces.SpaceMapping):
+    space_to = core.spaces.Space3DQuat
+    space_from = Space3D_TWIPR
+
+    def _map(self, state):
+        out = {
+            'pos': [state['pos']['x'], state['pos']['y'], 0],
+            'ori': twiprToQuat(state['theta'].value, state['psi'].value)
+        }
+        return out
+
+    def _mapBatch(self, batch):
+        pos = batch['pos']
+        out = {
+            'pos': np.column_stack((pos[:, 0], pos[:, 1], np.zeros(len(batch)))),
+            'ori': twiprToQuat(batch['theta'], batch['psi'])
+        }
+        return out
+
+
+class Mapping_3DQuat_2_TWIPR(core.spaces.SpaceMapping):
+    space_from = core.spaces.Space3DQuat
+    space_to = Space3D_TWIPR
+
+    def _map(self, state):
+        angles = twiprFromQuat(state['ori'].value)
+        out = {
+            'pos': [state['pos']['x'], state['pos']['y']],
+            'theta': angles[1],
+            'psi': angles[0]
+        }
+        return out
+
+    def _mapBatch(self, batch):
+        angles = twiprFromQuat(batch['ori'])
+        out = {
+            'pos': batch['pos'][:, 0:2],
+            'theta': angles[1],
+            'psi': angles[0]
+        }
+        return out
 
-Space3D_TWIPR.mappings = [Mapping_3D_2_TWIPR(), Mapping_TWIPR_2_3D()]
+
+Space3D_TWIPR.mappings = [Mapping_3D_2_TWIPR(), Mapping_TWIPR_2_3D(), Mapping_TWIPR_2_3DQuat()]
 core.spaces.Space3D.mappings.append(Mapping_3D_2_TWIPR())
+core.spaces.Space3DQuat.mappings.append(Mapping_3DQuat_2_TWIPR())
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -292,6 +356,7 @@ class TWIPR_3D_StateSpace_6D(core.spaces.Space):
 
 
 class TWIPR_3D_StateSpace_7D(core.spaces.Space):
+    array_backed = True  # The dynamics read the states through the accessor of the space without copying
     dimensions = [core.spaces.ScalarDimension(name='x'),
                   core.spaces.ScalarDimension(name='y'),
                   core.spaces.ScalarDimension(name='v'),
@@ -313,6 +378,14 @@ class Mapping_TWIPR_SS_2_TWIPR_CF(core.spaces.SpaceMapping):
         }
         return out
 
+    def _mapBatch(self, batch):
+        out = {
+            'pos': np.column_stack((batch['x'], batch['y'])),
+            'theta': batch['theta'],
+            'psi': batch['psi']
+        }
+        return out
+
 
 class Mapping_TWIPR_CF_2_TWIPR_SS(core.spaces.SpaceMapping):
     space_from = Space3D_TWIPR
@@ -327,6 +400,16 @@ class Mapping_TWIPR_CF_2_TWIPR_SS(core.spaces.SpaceMapping):
         }
         return out
 
+    def _mapBatch(self, batch):
+        pos = batch['pos']
+        out = {
+            'x': pos[:, 0],
+            'y': pos[:, 1],
+            'theta': batch['theta'],
+            'psi': batch['psi']
+        }
+        return out
+
 
 TWIPR_3D_StateSpace_7D.mappings = [Mapping_TWIPR_SS_2_TWIPR_CF(), Mapping_TWIPR_CF_2_TWIPR_SS()]
 
@@ -545,6 +628,7 @@ class TWIPR_Dynamics_3D(core.dynamics.Dynamics):
     input_space = TWIPR_3D_InputSpace()
     output_space = TWIPR_3D_StateSpace_7D()
     model: TwiprModel
+    trusted = True  # The integration only produces valid states, the pitch limit is applied in _dynamics
 
     # == INIT ==========================================================================================================
     def __init__(self, model: TwiprModel, Ts, poles=None, eigenvectors=None, speed_control: bool = False, *args,
@@ -558,23 +642,16 @@ class TWIPR_Dynamics_3D(core.dynamics.Dynamics):
         self.p = 2
         self.n = 7
 
-    # == METHODS ====================================================================================================
-    def update(self, input=None):
-        if input is not None:
-            self.input = input
-        self.state = self._dynamics(self.state, self.input)
-
     # == PRIVATE METHODS ===============================================================================================
     def _dynamics(self, state, input):
         g = 9.81
 
-        x = state[0].value
-        y = state[1].value
-        v = state[2].value
-        theta = state[3].value
-        theta_dot = state[4].value
-        psi = state[5].value
-        psi_dot = state[6].value
+        s = self.state_space.getAccessor(state)
+        v = s.v
+        theta = s.theta
+        theta_dot = s.theta_dot
+        psi = s.psi
+        psi_dot = s.psi_dot
 
         u = [input[0].value, input[1].value]
 
@@ -635,6 +712,10 @@ class TWIPR_Dynamics_3D(core.dynamics.Dynamics):
 
         state = state + state_dot * self.Ts
 
+        # The sum is written without projection in trusted mode, so the pitch limit of the state space is applied here
+        theta_lower, theta_upper = self.state_space['theta'].limits
+        state['theta'].value = min(max(state['theta'].value, theta_lower), theta_upper)
+
         return state
 
     # ------------------------------------------------------------------------------------------------------------------
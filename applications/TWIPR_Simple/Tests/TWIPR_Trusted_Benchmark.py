@@ -0,0 +1,49 @@
+import time
+
+import numpy as np
+
+import scioi_py_core.core as core
+from applications.TWIPR_Simple.Environment.EnvironmentTWIPR_objects import TWIPR_Dynamics_3D, TWIPR_Michael_Model
+
+
+def run(trusted: bool, steps: int, input: list):
+    dynamics = TWIPR_Dynamics_3D(Ts=0.02, model=TWIPR_Michael_Model)
+    dynamics.trusted = trusted
+    dynamics.state = [0, 0, 0, 0.1, 0, 0, 0]
+
+    # Count the trusted writes, to see that the trusted path of Dynamics.update is taken
+    trusted_writes = 0
+    set_trusted = core.spaces.State.setTrusted
+
+    def counting_set_trusted(self, values):
+        nonlocal trusted_writes
+        trusted_writes += 1
+        set_trusted(self, values)
+
+    core.spaces.State.setTrusted = counting_set_trusted
+    try:
+        t_start = time.perf_counter()
+        for _ in range(0, steps):
+            dynamics.update(input)
+        time_step = (time.perf_counter() - t_start) / steps
+    finally:
+        core.spaces.State.setTrusted = set_trusted
+
+    return dynamics.state.asArray().copy(), time_step, trusted_writes
+
+
+def main(steps: int = 100):
+    # Open loop, the robot falls over forwards or backwards and the pitch runs into its limit
+    for input in [[0, 0], [0.5, 0.5]]:
+        state_validated, time_validated, writes_validated = run(False, steps, input)
+        state_trusted, time_trusted, writes_trusted = run(True, steps, input)
+
+        print(f"TWIPR_Dynamics_3D.update, input {input}, {steps} steps")
+        print(f"  validated: {time_validated * 1e6:6.1f} us per step, {writes_validated:5d} trusted writes")
+        print(f"  trusted:   {time_trusted * 1e6:6.1f} us per step, {writes_trusted:5d} trusted writes")
+        print(f"  speedup: {time_validated / time_trusted:.2f}x, same states: "
+              f"{np.allclose(state_validated, state_trusted)}, theta: {state_trusted[3]:.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -26,6 +26,7 @@ class Dynamics(ScheduledObject):
     output: sp.State
     Ts: float
     state_initial: sp.State
+    trusted: bool = False  # _dynamics() only produces valid states, which are then written without validation
 
     # === INIT =========================================================================================================
     def __init__(self, input_space: sp.Space = None, output_space: sp.Space = None, state_space: sp.Space = None,
@@ -83,8 +84,11 @@ class Dynamics(ScheduledObject):
     def update(self, input=None):
         if input is not None:
             self.input = input
-        self.state = self._dynamics(self.state, self.input)
-        pass
+        if self.trusted:
+            with self.state_space.trusted():
+                self.state = self._dynamics(self.state, self.input)
+        else:
+            self.state = self._dynamics(self.state, self.input)
 
     # ------------------------------------------------------------------------------------------------------------------
     def reset(self):
@@ -150,6 +154,7 @@ class DynamicWorldObject(WorldObject, ABC):
 
     # === INIT =========================================================================================================
     def __init__(self, name, world=None, space: sp.Space=None, *args, **kwargs):
+        self._configuration_key = None  # Versions the configuration was mapped from
         super().__init__(name=name, world=world, space=space, *args, **kwargs)
 
         # Register the dynamics action in the World Dynamics Phase
@@ -168,7 +173,8 @@ class DynamicWorldObject(WorldObject, ABC):
 
     @property
     def configuration(self):
-        return self.space.map(self.dynamics.state)
+        # New State on every access, see getConfiguration() to write it into a reused State instead
+        return self._getConfigurationLocal().copy()
 
     @configuration.setter
     def configuration(self, value):
@@ -197,3 +203,13 @@ class DynamicWorldObject(WorldObject, ABC):
         self.dynamics.update()
 
     # === PRIVATE METHODS ==============================================================================================
+    def _getConfigurationLocal(self):
+        # Mapped into the configuration State of the object instead of creating a new State on every access, and only
+        # if the state of the dynamics, the mappings or the configuration itself have changed since the last access
+        state = self.dynamics.state
+        key = (state.version, sp._mapping_version)
+        if self._configuration_key == (key, self._configuration.version):
+            return self._configuration
+        self.space.map_into(state, self._configuration)
+        self._configuration_key = (key, self._configuration.version)
+        return self._configuration
@@ -13,6 +13,7 @@ class Environment(scheduling.ScheduledObject):
 
     run_mode: str
     Ts: float
+    catch_up: str = 'burst'  # Catch-up policy of the real-time scheduler: 'burst', 'skip' or 'slow_down'
 
     # TODO put these in a separate dataclass?
     '''
@@ -37,7 +38,7 @@ class Environment(scheduling.ScheduledObject):
     '''
 
     # === INIT =========================================================================================================
-    def __init__(self, run_mode: str = None, Ts: float = None, *args, **kwargs):
+    def __init__(self, run_mode: str = None, Ts: float = None, catch_up: str = None, *args, **kwargs):
         super().__init__()
 
         if run_mode is not None:
@@ -46,6 +47,12 @@ class Environment(scheduling.ScheduledObject):
         if Ts is not None:
             self.Ts = Ts
 
+        if catch_up is not None:
+            self.catch_up = catch_up
+
+        # Sample time of all objects below the environment and of their actions
+        self.scheduling.Ts = self.Ts
+
         # TODO: is it ok to do this here?. Probably some if it should be put somewhere else
         self.action_step = scheduling.Action(name='step', object=self)
         self.scheduling.actions['_entry'].parent = self.action_step
@@ -53,7 +60,8 @@ class Environment(scheduling.ScheduledObject):
         self.scheduling.actions['_exit'].parent = self.action_step
         self.scheduling.actions['_exit'].priority = 1000
 
-        self.scheduler = scheduling.Scheduler(action=self.action_step, mode=self.run_mode, Ts=self.Ts)
+        self.scheduler = scheduling.Scheduler(action=self.action_step, mode=self.run_mode, Ts=self.Ts,
+                                              catch_up=self.catch_up)
         pass
 
     # === PROPERTIES ===================================================================================================
@@ -68,6 +76,9 @@ class Environment(scheduling.ScheduledObject):
     def init(self, *args, **kwargs):
         self.scheduling.actions['_init'].run(*args, **kwargs)
 
+    def getTimingStatistics(self) -> dict:
+        return self.scheduler.getStatistics()
+
     def getVisualizationSample(self):
         sample = {
             'time': self.scheduling.tick_global * self.Ts,
@@ -0,0 +1,56 @@
+import time
+import tracemalloc
+
+import numpy as np
+
+from scioi_py_core.core import spaces as spaces
+
+
+def eager_copy(self, share: bool = False):
+    # Copy of a vector value as it was done before copy-on-write: new array, then the full set path
+    new_value = spaces.StateValue._copy(self)
+    new_value.value = np.ndarray(new_value.shape)
+    new_value.set(self.value)
+    return new_value
+
+
+def measure(n: int):
+    space = spaces.Space2D()
+    state1 = space.map([[1, 2], 0.5])
+    state2 = space.map([[0.1, -0.2], 0.1])
+
+    # Warm up the mapping cache and the projections
+    state1 + state2
+
+    t_start = time.perf_counter()
+    for _ in range(0, n):
+        state1 + state2
+    time_per_add = (time.perf_counter() - t_start) / n * 1e6
+
+    # Memory that is allocated for one addition, including temporaries that are freed again
+    tracemalloc.start()
+    state1 + state2
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return time_per_add, peak
+
+
+def example_copy_on_write(n: int = 20000):
+    time_cow, peak_cow = measure(n)
+
+    cow_copy = spaces.VectorValue._copy
+    spaces.VectorValue._copy = eager_copy
+    try:
+        time_eager, peak_eager = measure(n)
+    finally:
+        spaces.VectorValue._copy = cow_copy
+
+    print("Space2D._add (state1 + state2)")
+    print(f"  eager copies:  {time_eager:6.2f} us per addition, {peak_eager:6d} bytes peak allocation")
+    print(f"  copy-on-write: {time_cow:6.2f} us per addition, {peak_cow:6d} bytes peak allocation")
+    print(f"  speedup: {time_eager / time_cow:.2f}x, allocation saved: {peak_eager - peak_cow} bytes per addition")
+
+
+if __name__ == '__main__':
+    example_copy_on_write()
@@ -0,0 +1,45 @@
+import os
+import time
+
+import numpy as np
+
+from scioi_py_core.core import scheduling as scheduling
+
+
+def build_phase(n: int, size: int):
+    # One phase with an independent, numpy-heavy child action per agent
+    phase = scheduling.Action(name='dynamics')
+    for i in range(0, n):
+        matrix = np.random.rand(size, size) / size
+        state = np.random.rand(size, size)
+
+        def dynamics(matrix=matrix, state=state):
+            state[:] = matrix @ state
+
+        scheduling.Action(name=f"agent_{i}", function=dynamics, parent=phase)
+    return phase
+
+
+def measure(phase: scheduling.Action, steps: int):
+    phase()
+    t_start = time.perf_counter()
+    for _ in range(0, steps):
+        phase()
+    return (time.perf_counter() - t_start) / steps
+
+
+def example_parallel_phase(n: int = 32, size: int = 200, steps: int = 50):
+    phase = build_phase(n, size)
+    time_serial = measure(phase, steps)
+    phase.parallel = True
+    time_parallel = measure(phase, steps)
+
+    print(f"Phase with {n} agents, {size}x{size} matrix product per agent, {scheduling.getWorkers()} workers "
+          f"({os.cpu_count()} CPUs)")
+    print(f"  serial:   {time_serial * 1e3:7.2f} ms per step")
+    print(f"  parallel: {time_parallel * 1e3:7.2f} ms per step")
+    print(f"  speedup: {time_serial / time_parallel:.2f}x")
+
+
+if __name__ == '__main__':
+    example_parallel_phase()
@@ -0,0 +1,67 @@
+import logging
+import time
+
+from scioi_py_core.core import scheduling as scheduling
+from scioi_py_core.core import spaces as spaces
+from scioi_py_core.core import world as world
+
+
+class BenchmarkWorld(world.World):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        scheduling.Action(name='dynamics', object=self, priority=1)
+        scheduling.Action(name='physics_update', object=self, priority=2)
+
+
+def build_world(n: int):
+    # Construction of the world and its objects, followed by the init of the action tree
+    t_start = time.perf_counter()
+    w = BenchmarkWorld(space=spaces.Space3D())
+    for i in range(0, n):
+        world.WorldObject(name=f"object_{i}", world=w)
+    t_objects = time.perf_counter()
+    w.scheduling.actions['_init']()
+    t_init = time.perf_counter()
+    return t_objects - t_start, t_init - t_objects
+
+
+def example_world_construction(counts: list = None):
+    if counts is None:
+        counts = [250, 500, 1000, 2000, 4000]
+
+    print("World construction")
+    print(f"{'objects':>8} {'construction [ms]':>18} {'init [ms]':>10} {'per object [us]':>16}")
+    for n in counts:
+        time_objects, time_init = build_world(n)
+        time_total = time_objects + time_init
+        print(f"{n:8d} {time_objects * 1e3:18.1f} {time_init * 1e3:10.1f} {time_total / n * 1e6:16.1f}")
+
+
+def example_pruning(n: int = 1000, steps: int = 500):
+    # The default actions _entry and _exit of the objects are empty and are pruned from the compiled plans
+    w = BenchmarkWorld(space=spaces.Space3D())
+    for i in range(0, n):
+        world.WorldObject(name=f"object_{i}", world=w)
+    w.scheduling.actions['_init']()
+    actions = [w.scheduling.actions['_entry'], w.scheduling.actions['_exit']]
+
+    print(f"Pruning of empty actions ({n} objects, _entry and _exit)")
+    for prune in [False, True]:
+        scheduling.PRUNE_EMPTY_ACTIONS = prune
+        for action in actions:
+            action._invalidatePlan()
+        t_start = time.perf_counter()
+        for _ in range(0, steps):
+            for action in actions:
+                action()
+        time_step = (time.perf_counter() - t_start) / steps
+        print(f"  prune={prune!s:5}: {sum(len(action.compile()) for action in actions):5d} actions in the plans, "
+              f"{time_step * 1e6:8.1f} us per step")
+    scheduling.PRUNE_EMPTY_ACTIONS = True
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    example_world_construction()
+    example_pruning()
@@ -1,4 +1,5 @@
 import logging
+import time
 
 from scioi_py_core.core import scheduling as scheduling
 
@@ -79,6 +80,55 @@ def example_multiple_phases():
     phase_root(12, 'test', x=3)
 
 
+def example_multi_rate():
+    print("--- Example multi-rate actions")
+    # The root phase runs with 100 Hz
+    phase_root = scheduling.Action(name='phase_root')
+
+    # Controller with 100 Hz, collision check with 50 Hz and visualization with 25 Hz, shifted by one tick
+    scheduling.Action(name='controller', function=lambda: print("Controller"), parent=phase_root, priority=1)
+    scheduling.Action(name='collision', function=lambda: print("Collision"), parent=phase_root, priority=2,
+                      frequency=2)
+    scheduling.Action(name='visualization', function=lambda: print("Visualization"), parent=phase_root, priority=3,
+                      frequency=4, offset=1)
+
+    for tick in range(0, 4):
+        print(f"Tick {tick}")
+        phase_root()
+
+
+def example_dependencies():
+    print("--- Example dependencies")
+    # Instead of priorities, the order of the phases is given by their dependencies
+    phase_root = scheduling.Action(name='phase_root', parallel=True)
+    scheduling.Action(name='output', function=lambda: print("Output"), parent=phase_root, after='dynamics')
+    scheduling.Action(name='dynamics', function=lambda: print("Dynamics"), parent=phase_root, after='logic')
+    scheduling.Action(name='logic', function=lambda: print("Logic"), parent=phase_root)
+    scheduling.Action(name='sensors', function=lambda: print("Sensors"), parent=phase_root, before='logic')
+    scheduling.Action(name='input', function=lambda: print("Input"), parent=phase_root, before='logic')
+
+    # Sensors and input do not depend on each other and can run concurrently
+    print([[action.name for action in group] for group in phase_root.getConcurrentGroups()])
+    phase_root()
+
+
+def example_profiler():
+    print("--- Example profiler")
+    phase_root = scheduling.Action(name='phase_root')
+    phase_logic = scheduling.Action(name='logic', parent=phase_root, priority=1)
+    scheduling.Action(name='controller', function=lambda: sum(range(10000)), parent=phase_logic)
+    scheduling.Action(name='dynamics', function=lambda: sum(range(50000)), parent=phase_root, priority=2)
+
+    # Record every call. With sampling=10 only every 10th run of the plan would be recorded
+    profiler = scheduling.ActionProfiler(sampling=1)
+    with profiler:
+        for _ in range(0, 100):
+            phase_root()
+
+    print(profiler.getReport())
+    print(profiler.toCollapsed())
+
+
 def example_scheduled_objects():
     print("--- Example Scheduled Environment")
     # Define a scheduled object
@@ -120,9 +170,35 @@ def example_scheduler():
     sched.run(steps=10)
 
 
+def example_realtime_statistics():
+    print("--- Example real-time statistics")
+    tick = 0
+
+    # Every 5th tick takes 2.5 times as long as the sample time of 20 ms
+    def function():
+        nonlocal tick
+        tick = tick + 1
+        if tick % 5 == 0:
+            time.sleep(0.05)
+
+    action = scheduling.Action(function=function)
+
+    for catch_up in ['burst', 'skip', 'slow_down']:
+        tick = 0
+        sched = scheduling.Scheduler(action=action, mode='rt', Ts=0.02, catch_up=catch_up)
+        sched.run(steps=25)
+        statistics = sched.getStatistics()
+        print(f"{catch_up}: {statistics['overruns']} overruns, {statistics['skipped']} skipped, "
+              f"lag {statistics['lag'] * 1e3:.1f} ms, max jitter {statistics['jitter_max'] * 1e3:.1f} ms, "
+              f"behind: {sched.statistics.isBehind()}")
+
+
 if __name__ == '__main__':
     example_actions()
     example_phases()
     example_multiple_phases()
+    example_multi_rate()
+    example_dependencies()
+    example_profiler()
     example_scheduled_objects()
     # example_scheduler()
@@ -1,11 +1,77 @@
+import bisect
+import concurrent.futures
 import dataclasses
+import dis
 import enum
+import heapq
+import itertools
+import json
+import os
 import threading
 import time
+import weakref
 from abc import ABC, abstractmethod
 from typing import Union
 import simpy
 
+_executor: concurrent.futures.ThreadPoolExecutor = None  # Shared thread pool of the parallel actions
+_workers: int = None  # Number of threads of the pool. Default: number of CPUs
+_worker_thread = threading.local()
+_registrations = itertools.count()  # Order of the registrations of actions in their parents
+
+PRUNE_EMPTY_ACTIONS = True  # Compiled plans leave out actions that do nothing, see ActionPlan
+_empty_codes = {}  # Code object -> True if the function body is empty, see isEmptyFunction
+
+_profiler: 'ActionProfiler' = None  # Active profiler of the compiled plans, see ActionProfiler.start
+
+
+class ActionDict(dict):
+    """
+    Dict of the parameters or lambdas of an action. Every change invalidates the compiled plans that contain the
+    action, since they hold merged copies of the parameters and lambdas
+    """
+    __slots__ = ('_action',)
+
+    def __init__(self, action: 'Action', *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._action = action
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._action._invalidatePlan()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._action._invalidatePlan()
+
+    def __ior__(self, other):
+        super().__ior__(other)
+        self._action._invalidatePlan()
+        return self
+
+    def clear(self):
+        super().clear()
+        self._action._invalidatePlan()
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._action._invalidatePlan()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._action._invalidatePlan()
+        return item
+
+    def setdefault(self, key, default=None):
+        value = super().setdefault(key, default)
+        self._action._invalidatePlan()
+        return value
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._action._invalidatePlan()
+
 
 class Action:
     """
@@ -14,13 +80,17 @@ class Action:
     """
     function: callable  # Function that is going to be called
     actions: dict[str, 'Action']
-    parameters: dict  # Default arguments that are going to be set
-    lambdas: dict  # List of lambdas executed before the function call
+    parameters: dict  # Default arguments that are going to be set. Kept as ActionDict, see the parameters property
+    lambdas: dict  # List of lambdas executed before the function call. Kept as ActionDict
     object: 'ScheduledObject'  # Object this action is associated with
     parent: 'Action'
 
-    frequency: int  # TODO Default 1. This action is only executed every <frequency> calls of the corresponding phase
+    frequency: int  # Default 1. This action is only executed every <frequency> calls of the corresponding phase
+    offset: int  # Default 0. Phase offset: the action is executed in the calls offset, offset + frequency, ...
     priority: int  # TODO Default 1. Not used yet
+    parallel: bool  # Default False. The child actions are independent and are executed concurrently, see ActionPlan
+    after: tuple  # Names or actions of sibling actions that have to be executed before this action. Read-only
+    before: tuple  # Names or actions of sibling actions that have to be executed after this action. Read-only
 
     # TODO: One shot actions
 
@@ -28,22 +98,35 @@ class Action:
 
     def __init__(self, function: callable = None, parent: 'Action' = None, parameters=None, lambdas=None,
                  object: 'ScheduledObject' = None,
-                 frequency: int = 1, priority: int = 1, name: str = ""):
+                 frequency: int = 1, priority: int = 1, name: str = "", offset: int = 0, parallel: bool = False,
+                 after: list = None, before: list = None):
 
         if lambdas is None:
             lambdas = {}
         if parameters is None:
             parameters = {}
 
+        self._parent = None
+        self._plan = None  # Compiled ActionPlan of the tree under this action, see run()
+
         self.actions = {}
+        self._priorities = []  # Sorted priorities of the child actions, in the order of self.actions
+        self._dependencies = 0  # Number of child actions with after or before dependencies
         self.parameters = parameters
         self.lambdas = lambdas
 
+        assert (frequency >= 1 and 0 <= offset < frequency)
         self.function = function
-        self.frequency = frequency
-        self.priority = priority
+        self._frequency = frequency
+        self._offset = offset
+        self._priority = priority
+        self._parallel = parallel
+        self._after = self._toTuple(after)
+        self._before = self._toTuple(before)
+        self._sequence = 0  # Registration number in the parent. Orders actions with the same priority
 
-        self._parent = None
+        self._calls = 0  # Number of calls of the parent phase, counted for actions with their own rate
+        self._tick = 0  # Number of executions, counted for actions with their own rate
 
         if name is None:
             if function is not None:
@@ -62,6 +145,34 @@ class Action:
             object.registerAction(self)
 
     # == PROPERTIES ====================================================================================================
+    @property
+    def function(self):
+        return self._function
+
+    @function.setter
+    def function(self, value: callable):
+        self._function = value
+        self._invalidatePlan()
+
+    @property
+    def parameters(self) -> dict:
+        return self._parameters
+
+    @parameters.setter
+    def parameters(self, value: dict):
+        # The items are copied into an ActionDict, so that later changes also reach the compiled plans
+        self._parameters = ActionDict(self, value)
+        self._invalidatePlan()
+
+    @property
+    def lambdas(self) -> dict:
+        return self._lambdas
+
+    @lambdas.setter
+    def lambdas(self, value: dict):
+        self._lambdas = ActionDict(self, value)
+        self._invalidatePlan()
+
     @property
     def parent(self):
         return self._parent
@@ -72,14 +183,123 @@ class Action:
         if value is not None:
             value.registerAction(self)
 
+    @property
+    def after(self) -> tuple:
+        # Changed with setDependencies(), which also re-orders the action in its parent
+        return self._after
+
+    @property
+    def before(self) -> tuple:
+        return self._before
+
+    @property
+    def priority(self):
+        return self._priority
+
+    @priority.setter
+    def priority(self, value):
+        # A registered action is moved to its new position in the parent
+        parent = self._parent
+        if parent is not None and value != self._priority:
+            parent.removeAction(self)
+            self._priority = value
+            parent.registerAction(self)
+        else:
+            self._priority = value
+
+    @property
+    def frequency(self):
+        return self._frequency
+
+    @frequency.setter
+    def frequency(self, value: int):
+        assert (value >= 1 and self._offset < value)
+        self._frequency = value
+        self._invalidatePlan()
+
+    @property
+    def offset(self):
+        return self._offset
+
+    @offset.setter
+    def offset(self, value: int):
+        assert (0 <= value < self._frequency)
+        self._offset = value
+        self._invalidatePlan()
+
+    @property
+    def parallel(self):
+        return self._parallel
+
+    @parallel.setter
+    def parallel(self, value: bool):
+        self._parallel = value
+        self._invalidatePlan()
+
+    @property
+    def tick(self) -> int:
+        """
+        Number of executions of the action. Actions that run at the rate of their parent share its tick
+        """
+        if self._frequency == 1 and self._offset == 0 and self._parent is not None:
+            return self._parent.tick
+        return self._tick
+
+    @property
+    def Ts(self):
+        """
+        Sample time of the action: <frequency> times the sample time of the parent phase. An action without parent
+        is called at the sample time of its object's parent, see SchedulingData.Ts_parent. None if there is none
+        """
+        if self._parent is not None:
+            Ts = self._parent.Ts
+        elif self.object is not None:
+            Ts = self.object.scheduling.Ts_parent
+        else:
+            return None
+        return None if Ts is None else Ts * self._frequency
+
+    @property
+    def t(self):
+        """
+        Time of the last execution of the action. None before the first execution
+        """
+        t0 = self._getStartTime()
+        if t0 is None or self.tick == 0:
+            return None
+        return t0 + (self.tick - 1) * self.Ts
+
     # == METHODS =======================================================================================================
     def run(self, *args, **kwargs):
         """
-        Run the function with the provided arguments and the stored default arguments
+        Run the function with the provided arguments and the stored default arguments, followed by all child actions.
+        The tree under this action is executed from its compiled plan, which is rebuilt whenever the tree changes
         :param args:
         :param kwargs:
         :return:
         """
+        if not self._isDue():
+            return
+
+        if 'calltree' in kwargs and kwargs['calltree']:
+            return self._runTree(*args, **kwargs)
+
+        if self._plan is None:
+            self._plan = ActionPlan(self)
+        self._plan.run(args, kwargs)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def compile(self) -> 'ActionPlan':
+        """
+        Returns the compiled plan of the tree under this action
+        """
+        if self._plan is None:
+            self._plan = ActionPlan(self)
+        return self._plan
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _runTree(self, *args, **kwargs):
+        # Recursive execution of the tree. Used for debugging with the calltree argument
 
         # Debug: Check for the calltree argument
         if 'calltree' in kwargs and kwargs['calltree']:
@@ -95,38 +315,76 @@ class Action:
 
         # Run the child actions
         for name, actions in self.actions.items():
-            actions(*args, **{**self.parameters, **kwargs, **lambdas_exec})
+            if actions._isDue():
+                actions._runTree(*args, **{**self.parameters, **kwargs, **lambdas_exec})
 
+    # ------------------------------------------------------------------------------------------------------------------
     def registerAction(self, action):
         """
-        Registers the given action or list of actions in the phase.
+        Registers the given action or list of actions in the phase. The child actions are ordered by priority and
+        actions with the same priority in the order of their registration. If children have after or before
+        dependencies, they are ordered topologically, see _orderChildren(). A list is registered in one go
         :param action: Action or List -> Action(s) to be added
         :return:
         """
         if isinstance(action, list):
             for ac in action:
                 assert (isinstance(ac, Action))
-                self.registerAction(ac)
+                assert (ac.parent is None)
+
+            for ac in action:
+                ac._parent = self
+                ac._sequence = next(_registrations)
+                if ac.after or ac.before:
+                    self._dependencies += 1
+                self.actions[self._getChildName(ac)] = ac
+
+            if self._dependencies > 0:
+                try:
+                    self._orderChildren()
+                except Exception:
+                    for ac in action:
+                        self._rollbackRegistration(ac)
+                    raise
+            else:
+                # One stable sort for the whole list
+                self.actions = {k: v for k, v in sorted(self.actions.items(), key=lambda item: item[1].priority)}
+                self._priorities = [ac.priority for ac in self.actions.values()]
+            self._invalidatePlan()
 
         elif isinstance(action, Action):
 
             assert (action.parent is None)
             action._parent = self
-
-            if action.name in self.actions:
-                name = f"{action.name}_{id(action)}"
+            action._sequence = next(_registrations)
+            name = self._getChildName(action)
+
+            if action.after or action.before:
+                self._dependencies += 1
+
+            if self._dependencies > 0:
+                self.actions[name] = action
+                try:
+                    self._orderChildren()
+                except Exception:
+                    self._rollbackRegistration(action)
+                    raise
             else:
-                name = action.name
-
-            self.actions[name] = action
-            if action.parent is not self:
-                action.parent = self
-
-            # Sort the dict by priority
-            self.actions = {k: v for k, v in sorted(self.actions.items(), key=lambda item: item[1].priority)}
+                # Insert behind all actions with the same or a lower priority
+                position = bisect.bisect_right(self._priorities, action.priority)
+                self._priorities.insert(position, action.priority)
+                if position == len(self.actions):
+                    self.actions[name] = action
+                else:
+                    items = list(self.actions.items())
+                    items.insert(position, (name, action))
+                    self.actions = dict(items)
+
+            self._invalidatePlan()
         elif callable(action):
             self.registerAction(Action(action))
 
+    # ------------------------------------------------------------------------------------------------------------------
     def removeAction(self, action):
         """
         Removes the given action or list of actions from the phase.
@@ -139,17 +397,521 @@ class Action:
                 self.removeAction(ac)
 
         elif isinstance(action, Action):
-            del (self.actions[action.name])
-            action.parent = None
+            # Actions with the same name are registered under a name with their id
+            name = action.name
+            if self.actions.get(name) is not action:
+                name = f"{action.name}_{id(action)}"
+            del (self.actions[name])
+            action._parent = None
+
+            if self._dependencies > 0:
+                if action.after or action.before:
+                    self._dependencies -= 1
+                # Dependencies of the other children on the removed action are gone
+                self._orderChildren()
+            else:
+                # Removing keeps the order, only the priority has to go
+                self._priorities.remove(action.priority)
+            self._invalidatePlan()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def setDependencies(self, after: list = None, before: list = None):
+        """
+        Replaces the after and before dependencies of the action and re-orders it in its parent. If the new
+        dependencies can not be ordered, the action keeps its old dependencies and its position in the parent
+        """
+        parent = self._parent
+        old_after, old_before = self._after, self._before
+        if parent is None:
+            self._after = self._toTuple(after)
+            self._before = self._toTuple(before)
+            return
+
+        actions, priorities, dependencies, sequence = (dict(parent.actions), list(parent._priorities),
+                                                       parent._dependencies, self._sequence)
+        parent.removeAction(self)
+        self._after = self._toTuple(after)
+        self._before = self._toTuple(before)
+        try:
+            parent.registerAction(self)
+        except Exception:
+            # Put the action back where it was
+            self._after, self._before = old_after, old_before
+            parent.actions, parent._priorities, parent._dependencies = actions, priorities, dependencies
+            self._sequence = sequence
+            self._parent = parent
+            parent._invalidatePlan()
+            raise
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def getConcurrentGroups(self) -> list[list['Action']]:
+        """
+        Splits the child actions, in their order, into groups of consecutive actions without dependencies between
+        each other. The actions of a group can run concurrently, the groups run one after the other. Without
+        dependencies all children are in one group
+        """
+        children = list(self.actions.values())
+        edges = self._getDependencyEdges(children)
+        groups = []
+        group_start = 0
+        for position in range(0, len(children)):
+            if position == 0 or any(group_start <= first < position for first in edges[position]):
+                group_start = position
+                groups.append([])
+            groups[-1].append(children[position])
+        return groups
+
+    # == PRIVATE METHODS ===============================================================================================
+    def _getChildName(self, action: 'Action') -> str:
+        if action.name in self.actions:
+            return f"{action.name}_{id(action)}"
+        return action.name
 
-            # Sort the dict by priority
-            self.actions = {k: v for k, v in sorted(self.actions.items(), key=lambda item: item[1].priority)}
+    # ------------------------------------------------------------------------------------------------------------------
+    def _getDependencyEdges(self, children: list['Action']) -> list[list[int]]:
+        # For every child the positions of the children that have to be executed before it. Dependencies on actions
+        # that are not registered in this phase are ignored
+        positions = {}
+        for position, child in enumerate(children):
+            positions.setdefault(id(child), []).append(position)
+            positions.setdefault(child.name, []).append(position)
+
+        edges = [[] for _ in children]
+        for position, child in enumerate(children):
+            for dependency in child.after:
+                key = id(dependency) if isinstance(dependency, Action) else dependency
+                edges[position].extend(positions.get(key, []))
+            for dependency in child.before:
+                key = id(dependency) if isinstance(dependency, Action) else dependency
+                for other in positions.get(key, []):
+                    edges[other].append(position)
+        return edges
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _orderChildren(self):
+        # Topological order of the children. Of all actions whose dependencies are executed, the one with the lowest
+        # priority comes first, so without dependencies this is the order by priority and registration
+        children = sorted(self.actions.items(), key=lambda item: (item[1].priority, item[1]._sequence))
+        edges = self._getDependencyEdges([action for _, action in children])
+
+        successors = [[] for _ in children]
+        missing = [0] * len(children)
+        for position, firsts in enumerate(edges):
+            for first in set(firsts):
+                if first == position:
+                    raise Exception(f"Action {children[position][1].name} depends on itself")
+                successors[first].append(position)
+                missing[position] += 1
+
+        ready = [position for position in range(0, len(children)) if missing[position] == 0]
+        heapq.heapify(ready)
+        order = []
+        while len(ready) > 0:
+            position = heapq.heappop(ready)
+            order.append(position)
+            for successor in successors[position]:
+                missing[successor] -= 1
+                if missing[successor] == 0:
+                    heapq.heappush(ready, successor)
+
+        if len(order) < len(children):
+            cycle = [children[position][1].name for position in range(0, len(children)) if missing[position] > 0]
+            raise Exception(f"Cyclic dependencies between the actions {cycle} of {self.name}")
+
+        self.actions = dict(children[position] for position in order)
+        self._priorities = [action.priority for action in self.actions.values()]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _rollbackRegistration(self, action: 'Action'):
+        # Removes an action whose registration failed because of its dependencies. The order is left untouched
+        for name, child in list(self.actions.items()):
+            if child is action:
+                del self.actions[name]
+        action._parent = None
+        if action.after or action.before:
+            self._dependencies -= 1
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _toTuple(dependencies) -> tuple:
+        if dependencies is None:
+            return ()
+        if isinstance(dependencies, (str, Action)):
+            return (dependencies,)
+        return tuple(dependencies)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _isDue(self) -> bool:
+        # Counts a call of the parent phase and returns if the action is executed in it. Actions without parent count
+        # all their executions
+        if self._frequency == 1 and self._offset == 0 and self._parent is not None:
+            return True
+        call = self._calls
+        self._calls = call + 1
+        if call < self._offset or (call - self._offset) % self._frequency:
+            return False
+        self._tick += 1
+        return True
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _getStartTime(self):
+        # Time of the first execution
+        if self._parent is None:
+            return 0 if self.Ts is not None else None
+        t0 = self._parent._getStartTime()
+        if t0 is None:
+            return None
+        return t0 + self._offset * self._parent.Ts
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _invalidatePlan(self):
+        # The plans of this action and of all actions above it contain the changed part of the tree
+        action = self
+        while action is not None:
+            action._plan = None
+            action = action._parent
 
     # == BUILT-INS =====================================================================================================
     def __call__(self, *args, **kwargs):
         return self.run(*args, **kwargs)
 
 
+# ======================================================================================================================
+class ActionPlan:
+    """
+    Flat execution plan of the tree under an action. The actions are listed in the order in which Action.run visits
+    them, with the parameters of each action and of its parents merged once. Only the lambdas are evaluated when the
+    plan is run. Parameters of a parent override the ones of a child, followed by the arguments of the call and the
+    lambdas from the root down to the action, like in the recursive execution. Functions, parameters and lambdas are
+    taken when the plan is compiled. Actions with their own rate are skipped together with all actions below them in
+    the calls of their parent in which they are not due.
+    The children of a parallel action are run after its function in waves, which follow the dependencies of the
+    children, see Action.getConcurrentGroups(). The children of a wave are split into contiguous groups, one per worker
+    thread, which are run concurrently. Each wave is finished before the next one starts. Parallel actions inside a
+    worker thread run serially.
+    Empty functions (only 'pass', '...' or a docstring) are not called, and actions without function and without
+    children are left out of the plan, unless they have their own rate or lambdas. The pruned actions are listed in
+    <pruned> and by getReport(). Pruning is switched off with PRUNE_EMPTY_ACTIONS
+    """
+    root: Action
+    steps: list[tuple]  # (action, function, parameters, lambdas, slot, inherited_slot, rate, end, branches) per action
+    slots: int  # Number of actions with lambdas. Their merged lambda results are passed down to the children
+    pruned: list[tuple]  # (action, reason) for all actions that are left out or whose function is not called
+
+    def __init__(self, root: Action):
+        self.root = root
+        self.steps = []
+        self.slots = 0
+        self.pruned = []
+        self._runs = 0  # Number of runs, counted while a profiler is active
+        self._compile(root, {}, -1)
+
+    # === METHODS ======================================================================================================
+    def run(self, args: tuple = (), kwargs: dict = None):
+        if kwargs is None:
+            kwargs = {}
+        if _profiler is not None:
+            self._runs += 1
+            if (self._runs - 1) % _profiler.sampling == 0:
+                self._run(0, len(self.steps), args, kwargs, [None] * self.slots, _profiler)
+                return
+        self._run(0, len(self.steps), args, kwargs, [None] * self.slots)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def getActions(self) -> list[Action]:
+        return [step[0] for step in self.steps]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def getReport(self) -> str:
+        """
+        Lists the actions that were pruned from the plan
+        """
+        lines = [f"Plan of {self.root.name}: {len(self.steps)} actions, {len(self.pruned)} pruned"]
+        for action, reason in self.pruned:
+            object_name = action.object.name if action.object is not None else None
+            lines.append(f"  {action.name} (Object: {object_name}): {reason}")
+        return '\n'.join(lines)
+
+    # === PRIVATE METHODS ==============================================================================================
+    def _run(self, i: int, n: int, args: tuple, kwargs: dict, slots: list, profiler: 'ActionProfiler' = None):
+        # Runs the steps i to n-1. The slots of the lambdas are shared with the branches of parallel actions, which
+        # only write the slots of their own actions. With a profiler, the time of every executed action and of the
+        # actions below it is recorded. Actions whose subtree is still running are kept as (end, index, start time,
+        # own time)
+        steps = self.steps
+        if profiler is not None:
+            paths = profiler._getPaths(self)
+            clock = time.perf_counter
+            running = []
+        while i < n:
+            if profiler is not None:
+                while running and running[-1][0] <= i:
+                    _, index, t_start, own = running.pop()
+                    profiler._record(paths[index], clock() - t_start, own)
+
+            action, function, parameters, lambdas, slot, inherited_slot, rate, end, branches = steps[i]
+            if rate and not action._isDue():
+                i = end
+                continue
+            index = i
+            i += 1
+
+            if profiler is not None:
+                t_start = clock()
+            dynamic = slots[inherited_slot] if inherited_slot >= 0 else None
+            if lambdas is not None:
+                dynamic = {**dynamic} if dynamic is not None else {}
+                for key, function_lambda in lambdas:
+                    dynamic[key] = function_lambda()
+                slots[slot] = dynamic
+
+            if function is not None:
+                if kwargs or dynamic:
+                    function(*args, **{**parameters, **kwargs, **(dynamic or {})})
+                else:
+                    function(*args, **parameters)
+            if profiler is not None:
+                running.append((end, index, t_start, clock() - t_start))
+
+            if branches is not None and not getattr(_worker_thread, 'active', False):
+                for wave in branches:
+                    self._runParallel(wave, args, kwargs, slots, profiler)
+                i = end
+
+        if profiler is not None:
+            while running:
+                _, index, t_start, own = running.pop()
+                profiler._record(paths[index], clock() - t_start, own)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _runParallel(self, branches: tuple, args: tuple, kwargs: dict, slots: list, profiler: 'ActionProfiler'):
+        # The branches are the start indices of the children of one wave, followed by the end of the last child. The
+        # children are split into one contiguous range per worker. The last range is run in the calling thread
+        children = len(branches) - 1
+        groups = min(getWorkers(), children)
+        bounds = [branches[(j * children) // groups] for j in range(0, groups + 1)]
+
+        executor = getExecutor()
+        futures = [executor.submit(self._run, bounds[j], bounds[j + 1], args, kwargs, slots, profiler)
+                   for j in range(0, groups - 1)]
+        try:
+            self._run(bounds[-2], bounds[-1], args, kwargs, slots, profiler)
+        finally:
+            # Barrier. All groups are finished before the wave returns, also if the calling thread raised
+            concurrent.futures.wait(futures)
+
+        # Exceptions of the workers are raised here
+        for future in futures:
+            future.result()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _compile(self, action: Action, parameters_parent: dict, inherited_slot: int) -> bool:
+        # Appends the steps of the action and all actions below it. Returns False if the action was pruned
+        parameters = {**action.parameters, **parameters_parent}
+
+        lambdas = None
+        slot = inherited_slot
+        if len(action.lambdas) > 0:
+            lambdas = tuple(action.lambdas.items())
+            slot = self.slots
+            self.slots += 1
+
+        # The rate of the root is handled by Action.run
+        rate = action is not self.root and (action.frequency != 1 or action.offset != 0)
+
+        function = action.function
+        empty = PRUNE_EMPTY_ACTIONS and function is not None and isEmptyFunction(function)
+        if empty:
+            function = None
+
+        index = len(self.steps)
+        self.steps.append(None)
+        starts = []
+        kept = []
+        for child in action.actions.values():
+            start = len(self.steps)
+            if self._compile(child, parameters, slot):
+                starts.append(start)
+                kept.append(child)
+
+        # Lambdas may have side effects, so actions with lambdas are kept
+        if (PRUNE_EMPTY_ACTIONS and function is None and lambdas is None and len(kept) == 0 and not rate
+                and action is not self.root):
+            del self.steps[index:]
+            self.pruned.append((action, 'empty function' if empty else 'no function and no children'))
+            return False
+        if empty:
+            self.pruned.append((action, 'empty function, not called'))
+
+        # Index of the first step after the actions below this one
+        end = len(self.steps)
+        starts.append(end)
+
+        # The children of a parallel action run in waves of concurrent groups, see Action.getConcurrentGroups()
+        branches = None
+        if action.parallel and len(kept) > 1:
+            branches = []
+            position = 0
+            kept_ids = {id(child) for child in kept}
+            for group in action.getConcurrentGroups():
+                count = sum(1 for child in group if id(child) in kept_ids)
+                if count > 0:
+                    branches.append(tuple(starts[position:position + count + 1]))
+                    position += count
+            branches = tuple(branches)
+        self.steps[index] = (action, function, parameters, lambdas, slot, inherited_slot, rate, end, branches)
+        return True
+
+    # === BUILT-INS ====================================================================================================
+    def __len__(self):
+        return len(self.steps)
+
+
+# ======================================================================================================================
+class ActionProfiler:
+    """
+    Records the number of calls, the cumulative and the maximum time of every action that is executed from a compiled
+    plan while the profiler is active. The actions are keyed by their path in the action tree, e.g.
+    'environment.step/environment.world/world.dynamics/A0.dynamics'. The total time of an action includes the actions
+    below it, the own time only its lambdas and its function.
+    With sampling > 1, only every <sampling>-th run of each plan is recorded, which keeps the overhead low for long
+    runs. An inactive profiler costs one check per plan run.
+    The results are exported as collapsed stacks for flame graphs (own time in microseconds) or as a JSON summary
+    """
+    sampling: int
+    statistics: dict  # path -> [calls, total time, maximum time, own time]
+
+    def __init__(self, sampling: int = 1):
+        assert (sampling >= 1)
+        self.sampling = sampling
+        self.statistics = {}
+        self._paths = weakref.WeakKeyDictionary()  # ActionPlan -> path of every step
+        self._lock = threading.Lock()
+
+    # === METHODS ======================================================================================================
+    def start(self):
+        global _profiler
+        _profiler = self
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def stop(self):
+        global _profiler
+        if _profiler is self:
+            _profiler = None
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def reset(self):
+        self.statistics = {}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def getStatistics(self) -> dict:
+        """
+        Statistics per action path. The times are in seconds. The estimated calls and total time are scaled by the
+        sampling interval
+        """
+        statistics = {}
+        for path, (calls, total, maximum, own) in self.statistics.items():
+            statistics[path] = {
+                'calls': calls,
+                'total': total,
+                'mean': total / calls,
+                'max': maximum,
+                'own': own,
+                'calls_estimated': calls * self.sampling,
+                'total_estimated': total * self.sampling,
+            }
+        return statistics
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def getReport(self, n: int = 20) -> str:
+        """
+        The <n> actions with the highest total time
+        """
+        lines = [f"{'total [ms]':>11} {'own [ms]':>10} {'mean [us]':>10} {'max [us]':>10} {'calls':>8}  action"]
+        ranked = sorted(self.statistics.items(), key=lambda item: item[1][1], reverse=True)
+        for path, (calls, total, maximum, own) in ranked[:n]:
+            lines.append(f"{total * 1e3:11.3f} {own * 1e3:10.3f} {total / calls * 1e6:10.1f} {maximum * 1e6:10.1f} "
+                         f"{calls:8d}  {path}")
+        return '\n'.join(lines)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def toCollapsed(self, file: str = None) -> str:
+        """
+        Collapsed stacks ('frame;frame;frame value' per line) with the own time in microseconds, e.g. for
+        flamegraph.pl or speedscope
+        """
+        lines = []
+        for path, (calls, total, maximum, own) in self.statistics.items():
+            value = int(round(own * 1e6))
+            if value > 0:
+                frames = [frame.replace(';', '_').replace(' ', '_') for frame in path.split('/')]
+                lines.append(f"{';'.join(frames)} {value}")
+        collapsed = '\n'.join(lines)
+        if file is not None:
+            with open(file, 'w') as f:
+                f.write(collapsed + '\n')
+        return collapsed
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def toJSON(self, file: str = None) -> str:
+        summary = json.dumps({'sampling': self.sampling, 'actions': self.getStatistics()}, indent=2)
+        if file is not None:
+            with open(file, 'w') as f:
+                f.write(summary)
+        return summary
+
+    # === PRIVATE METHODS ==============================================================================================
+    def _record(self, path: str, total: float, own: float):
+        with self._lock:
+            entry = self.statistics.get(path)
+            if entry is None:
+                self.statistics[path] = [1, total, total, own]
+            else:
+                entry[0] += 1
+                entry[1] += total
+                if total > entry[2]:
+                    entry[2] = total
+                entry[3] += own
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _getPaths(self, plan: ActionPlan) -> list[str]:
+        paths = self._paths.get(plan)
+        if paths is None:
+            # Path of the root, including the actions above it
+            prefix = []
+            action = plan.root._parent
+            while action is not None:
+                prefix.insert(0, self._getFrame(action))
+                action = action._parent
+
+            paths = []
+            parents = []  # (end, path) of the enclosing actions
+            for i, step in enumerate(plan.steps):
+                while parents and parents[-1][0] <= i:
+                    parents.pop()
+                parent_path = parents[-1][1] if parents else '/'.join(prefix)
+                path = f"{parent_path}/{self._getFrame(step[0])}" if parent_path else self._getFrame(step[0])
+                paths.append(path)
+                parents.append((step[7], path))
+            self._paths[plan] = paths
+        return paths
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _getFrame(action: Action) -> str:
+        if action.object is not None:
+            return f"{action.object.name}.{action.name}"
+        return action.name
+
+    # === BUILT-INS ====================================================================================================
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
 # ======================================================================================================================
 @dataclasses.dataclass
 class SchedulingData:
@@ -166,8 +928,7 @@ class SchedulingData:
     events: dict = dataclasses.field(default_factory=list)  # Events
     actions: dict[str, Action] = dataclasses.field(default_factory=dict)
     _tick_global: int = 0
-
-    # TODO this needs Ts_global and a local Ts as soon as I allow frequencies of actions
+    frequency: int = 1  # Rate of the object: its actions are executed every <frequency> ticks, see setRate()
 
     @property
     def tick_global(self):
@@ -193,7 +954,7 @@ class SchedulingData:
 
     @property
     def t(self):
-        return self.tick_global * self.Ts
+        return self.tick_global * self.Ts_global
 
     @t.setter
     def t(self, value):
@@ -201,12 +962,28 @@ class SchedulingData:
             self._t = value
 
     @property
-    def Ts(self):
+    def Ts_global(self):
+        if self.parent is not None:
+            return self.parent.scheduling.Ts_global
+        else:
+            return self._Ts
+
+    @property
+    def Ts_parent(self):
+        # Sample time at which the actions of the object are called: the local sample time of the parent object
         if self.parent is not None:
             return self.parent.scheduling.Ts
         else:
             return self._Ts
 
+    @property
+    def Ts(self):
+        # Local sample time of the object. Compounds the rates of the parent objects like Action.Ts
+        Ts = self.Ts_parent
+        if Ts is None:
+            return None
+        return Ts * self.frequency
+
     @Ts.setter
     def Ts(self, value):
         if self.parent is None:
@@ -258,6 +1035,26 @@ class ScheduledObject(ABC):
         self.scheduling.actions[action.name] = action
         action.object = self
 
+    # ------------------------------------------------------------------------------------------------------------------
+    def setRate(self, frequency: int, offset: int = 0, actions: list = None):
+        """
+        Executes the actions of this object only every <frequency> ticks, starting in tick <offset>. By default all
+        actions except the default ones (starting with '_') are set, otherwise the actions with the given names
+        """
+        if actions is None:
+            actions = [name for name in self.scheduling.actions if not name.startswith('_')]
+
+        self.scheduling.frequency = frequency
+        for name in actions:
+            action = self.scheduling.actions[name]
+            # Set the offset first if it is reduced, so that it is always smaller than the frequency
+            if offset < action.offset:
+                action.offset = offset
+                action.frequency = frequency
+            else:
+                action.frequency = frequency
+                action.offset = offset
+
     # ------------------------------------------------------------------------------------------------------------------
     def registerChild(self, child: 'ScheduledObject'):
         # Register the default actions
@@ -318,23 +1115,118 @@ class SimpyEvents:
     reset: simpy.Event = None
 
 
+# ======================================================================================================================
+@dataclasses.dataclass
+class RealTimeStatistics:
+    """
+    Timing of the real-time loop of a Scheduler. The jitter of a tick is how late it started after its deadline, the
+    overrun is how far its step ran past the deadline of the next tick. The lag is the difference between the elapsed
+    wall-clock time and the elapsed simulation time, so a growing lag means the simulation falls behind
+    """
+    Ts: float = 1
+    ticks: int = 0
+    overruns: int = 0
+    skipped: int = 0  # Deadlines that were dropped by the 'skip' policy
+    jitter_max: float = 0
+    jitter_sum: float = 0
+    overrun_max: float = 0
+    overrun_sum: float = 0
+    lag: float = 0
+    # Upper bin edges of the histograms, relative to Ts. The last bin collects everything above the last edge
+    bins: tuple = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+    jitter_histogram: list = dataclasses.field(default_factory=list)
+    overrun_histogram: list = dataclasses.field(default_factory=list)
+
+    def __post_init__(self):
+        self.reset(self.Ts)
+
+    def reset(self, Ts: float = None):
+        if Ts is not None:
+            self.Ts = Ts
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter_max = 0
+        self.jitter_sum = 0
+        self.overrun_max = 0
+        self.overrun_sum = 0
+        self.lag = 0
+        self._edges = [edge * self.Ts for edge in self.bins]
+        self.jitter_histogram = [0] * (len(self.bins) + 1)
+        self.overrun_histogram = [0] * (len(self.bins) + 1)
+
+    def addTick(self, jitter: float, overrun: float):
+        self.ticks += 1
+        self.jitter_sum += jitter
+        if jitter > self.jitter_max:
+            self.jitter_max = jitter
+        self.jitter_histogram[bisect.bisect_left(self._edges, jitter)] += 1
+
+        if overrun > 0:
+            self.overruns += 1
+            self.overrun_sum += overrun
+            if overrun > self.overrun_max:
+                self.overrun_max = overrun
+            self.overrun_histogram[bisect.bisect_left(self._edges, overrun)] += 1
+
+    def isBehind(self, threshold: float = None) -> bool:
+        """
+        True if the simulation lags behind the wall-clock time by more than <threshold> seconds. Default: one tick
+        """
+        if threshold is None:
+            threshold = self.Ts
+        return self.lag > threshold
+
+    def getStatistics(self) -> dict:
+        return {
+            'Ts': self.Ts,
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'lag': self.lag,
+            'jitter_mean': self.jitter_sum / self.ticks if self.ticks > 0 else 0,
+            'jitter_max': self.jitter_max,
+            'overrun_mean': self.overrun_sum / self.overruns if self.overruns > 0 else 0,
+            'overrun_max': self.overrun_max,
+            'bins': [edge * self.Ts for edge in self.bins] + [float('inf')],
+            'jitter_histogram': list(self.jitter_histogram),
+            'overrun_histogram': list(self.overrun_histogram),
+        }
+
+
 # ======================================================================================================================
 class Scheduler:
+    """
+    Runs the step action once per tick. In 'fast' mode the compiled plan of the action is stepped in a plain loop
+    without simpy. In 'rt' mode every tick k is paced to the absolute deadline t_start + k*Ts on a monotonic clock, so
+    the timing errors do not accumulate. If a tick overruns, the catch-up policy decides what happens to the missed
+    deadlines:
+        'burst': the missed ticks are run back-to-back until the loop has caught up with the wall-clock
+        'skip': the missed deadlines are dropped and the loop continues at the next deadline in the future
+        'slow_down': the deadlines are shifted by the overrun, so the simulation runs slower than real time
+    The timing of the real-time loop is recorded in <statistics>. The previous simpy real-time environment is still
+    available as mode 'rt_simpy'
+    """
     action: Action
     simpy_env: simpy.Environment
     simpy_events: SimpyEvents
-    mode: str  # 'fast' or 'rt'. Default: 'rt'
+    mode: str  # 'fast', 'rt' or 'rt_simpy'. Default: 'rt'
     Ts: float
+    catch_up: str  # 'burst', 'skip' or 'slow_down'. Default: 'burst'
+    statistics: RealTimeStatistics
     # env: 'Environment'
     tick: int
     steps: int
     thread: threading.Thread
 
     # === INIT =========================================================================================================
-    def __init__(self, action, mode: str = 'rt', Ts: float = 1):
+    def __init__(self, action, mode: str = 'rt', Ts: float = 1, catch_up: str = 'burst'):
+        assert catch_up in ['burst', 'skip', 'slow_down']
         self.action = action
         self.mode = mode
         self.Ts = Ts
+        self.catch_up = catch_up
+        self.statistics = RealTimeStatistics(Ts=Ts)
         self.simpy_events = SimpyEvents()
         self.thread = None
 
@@ -354,6 +1246,11 @@ class Scheduler:
             self.thread = threading.Thread(target=self.run, args=[steps, False])
             self.thread.start()
 
+        if self.mode == 'fast':
+            return self._runFast(steps)
+        elif self.mode == 'rt':
+            return self._runRealTime(steps)
+
         if steps is not None:
             self.simpy_events.timeout = self.simpy_env.timeout(steps - 1)
 
@@ -386,11 +1283,34 @@ class Scheduler:
                 print("Simulation resumed")
                 raise Exception("Not implemented yet!")
 
+    # ------------------------------------------------------------------------------------------------------------------
+    def getStatistics(self) -> dict:
+        """
+        Timing statistics of the last real-time run, see RealTimeStatistics
+        """
+        return self.statistics.getStatistics()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def exit(self):
+        """
+        Stops the scheduler after the current tick
+        """
+        self._exit = True
+        if not self.simpy_events.exit.triggered:
+            self.simpy_events.exit.succeed()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def halt(self):
+        self._halt = True
+        if not self.simpy_events.halt.triggered:
+            self.simpy_events.halt.succeed()
+
     # === PRIVATE METHODS ==============================================================================================
     def _init(self):
-        if self.mode == 'rt':
+        # The simpy environment is also created in the 'fast' and 'rt' mode, so that the events can be used in both modes
+        if self.mode == 'rt_simpy':
             self.simpy_env = simpy.RealtimeEnvironment(factor=self.Ts, strict=False)
-        elif self.mode == 'fast':
+        elif self.mode in ['fast', 'rt']:
             self.simpy_env = simpy.Environment()
 
         self.simpy_events.reset = self.simpy_env.event()
@@ -399,6 +1319,9 @@ class Scheduler:
         self.simpy_events.timeout = self.simpy_env.event()
         self.simpy_events.resume = self.simpy_env.event()
 
+        self._exit = False
+        self._halt = False
+
         self.tick = 0
         self.steps = 0
 
@@ -406,17 +1329,167 @@ class Scheduler:
     def _run(self):
         while True:
             self._step(*self.args, **self.kwargs)
+            self.tick += 1
             yield self.simpy_env.timeout(1)
 
+    # ------------------------------------------------------------------------------------------------------------------
+    def _runFast(self, steps=None):
+        # Same semantics as the simpy loop: <steps> ticks, or until exit() or halt() are called
+        action = self.action
+        args = self.args
+        kwargs = self.kwargs
+        calltree = 'calltree' in kwargs and kwargs['calltree']
+        self.steps = 0
+
+        while True:
+            try:
+                while not (self._exit or self._halt):
+                    if calltree:
+                        self._step(*args, **kwargs)
+                    elif action._isDue():
+                        plan = action._plan
+                        if plan is None:
+                            plan = action.compile()
+                        plan.run(args, kwargs)
+
+                    self.tick += 1
+                    self.steps += 1
+                    if steps is not None and self.steps >= steps:
+                        print("Simulation Exit (Timeout)")
+                        return
+            except KeyboardInterrupt:
+                self._exit = True
+
+            if self._exit:
+                break
+            elif self._halt:
+                self._halt = False
+                print("Simulation halted")
+                raise Exception("Not implemented yet!")
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _runRealTime(self, steps=None):
+        # Same loop as in fast mode, but every tick waits for its deadline. The deadlines are absolute, so the sleep
+        # error of one tick does not delay all following ticks
+        action = self.action
+        args = self.args
+        kwargs = self.kwargs
+        calltree = 'calltree' in kwargs and kwargs['calltree']
+        clock = time.perf_counter
+        Ts = self.Ts
+        catch_up = self.catch_up
+        statistics = self.statistics
+        statistics.reset(Ts)
+        self.steps = 0
+
+        t_start = clock()
+        deadline = t_start
+
+        while True:
+            try:
+                while not (self._exit or self._halt):
+                    now = clock()
+                    if now < deadline:
+                        time.sleep(deadline - now)
+                        now = clock()
+                    jitter = now - deadline
+                    statistics.lag = now - t_start - self.steps * Ts
+
+                    if calltree:
+                        self._step(*args, **kwargs)
+                    elif action._isDue():
+                        plan = action._plan
+                        if plan is None:
+                            plan = action.compile()
+                        plan.run(args, kwargs)
+
+                    self.tick += 1
+                    self.steps += 1
+
+                    end = clock()
+                    deadline += Ts
+                    overrun = end - deadline
+                    if overrun > 0:
+                        if catch_up == 'skip':
+                            missed = int(overrun // Ts) + 1
+                            deadline += missed * Ts
+                            statistics.skipped += missed
+                        elif catch_up == 'slow_down':
+                            deadline = end
+
+                    statistics.addTick(jitter, overrun)
+
+                    if steps is not None and self.steps >= steps:
+                        print("Simulation Exit (Timeout)")
+                        return
+            except KeyboardInterrupt:
+                self._exit = True
+
+            if self._exit:
+                break
+            elif self._halt:
+                self._halt = False
+                print("Simulation halted")
+                raise Exception("Not implemented yet!")
+
     # ------------------------------------------------------------------------------------------------------------------
     def _step(self, *args, **kwargs):
         self.action(*args, **kwargs)
 
 
+# ======================================================================================================================
+def isEmptyFunction(function: callable) -> bool:
+    """
+    True if the function or method does nothing, i.e. its body is only 'pass', '...', 'return None' or a docstring.
+    Other callables are never empty
+    """
+    code = getattr(getattr(function, '__func__', function), '__code__', None)
+    if code is None:
+        return False
+    empty = _empty_codes.get(code)
+    if empty is None:
+        instructions = [instruction for instruction in dis.get_instructions(code) if
+                        instruction.opname not in ('RESUME', 'NOP', 'MAKE_CELL', 'COPY_FREE_VARS')]
+        opnames = [instruction.opname for instruction in instructions]
+        if opnames == ['LOAD_CONST', 'RETURN_VALUE']:
+            empty = instructions[0].argval is None
+        else:
+            empty = opnames == ['RETURN_CONST'] and instructions[0].argval is None
+        _empty_codes[code] = empty
+    return empty
+
+
+def setWorkers(workers: int = None):
+    """
+    Sets the number of worker threads of the parallel actions. Default: number of CPUs
+    """
+    global _executor, _workers
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    _workers = workers
+
+
+def getWorkers() -> int:
+    return _workers if _workers is not None else (os.cpu_count() or 1)
+
+
+def getExecutor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=getWorkers(), thread_name_prefix='action',
+                                                          initializer=_initWorker)
+    return _executor
+
+
+def _initWorker():
+    _worker_thread.active = True
+
+
 def registerActions(object: ScheduledObject, parent_action: Action, default_actions: bool = False,
                     exclude: list = None):
     # TODO: Add exclude list
 
-    for name, act in object.scheduling.actions.items():
-        if not default_actions and not (name.startswith("_")):
-            act.parent = parent_action
+    actions = [act for name, act in object.scheduling.actions.items() if
+               not default_actions and not (name.startswith("_"))]
+    parent_action.registerAction(actions)
@@ -1,5 +1,11 @@
 import abc
-import copy as cp
+import collections
+import contextlib
+import copy
+import itertools
+import math
+import threading
+import types
 from math import pi
 
 import numpy as np
@@ -16,13 +22,68 @@ def dumper(obj):
         return obj.__dict__
 
 
+def _typeAttribute(cls: type, name: str, default=None):
+    # Class level attribute of a value type. The slots of the value classes are not values and count as missing
+    value = getattr(cls, name, default)
+    if isinstance(value, types.MemberDescriptorType):
+        return default
+    return value
+
+
+ENCODING_DTYPE = np.dtype('<f8')  # Binary encoding of states: flat little-endian float64 in the layout of the space
+
+VALIDATE_TRUSTED_WRITES = False  # Debug mode: every trusted write is checked afterwards, see State.setTrusted
+
+_state_versions = itertools.count(1)  # Source of the write versions of values and States, see State.version
+
+_thread_state = threading.local()  # Per-thread state: depths of the trusted() blocks, see Space.trusted
+
+
+def decodeToDict(schema: dict, data: (bytes, np.ndarray)) -> dict:
+    """
+    Decodes an encoded state into the same structure as State.serialize() by only using the schema of its space,
+    e.g. on the receiving side of a logger or visualization that does not know the space classes
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = np.frombuffer(data, dtype=ENCODING_DTYPE)
+    assert (len(data) == schema['size'])
+
+    out = {}
+    for dim in schema['dimensions']:
+        offset = dim['offset']
+        shape = dim['shape']
+        if shape is None:
+            # None is encoded as NaN
+            value = float(data[offset])
+            out[dim['name']] = None if value != value else value
+        elif dim['names'] is not None:
+            out[dim['name']] = {name: float(data[offset + i]) for i, name in enumerate(dim['names'])}
+        else:
+            out[dim['name']] = data[offset:offset + int(np.prod(shape))].reshape(shape).tolist()
+    return out
+
+
 class StateValue(abc.ABC):
+    """
+    Value of one dimension of a State. copy() returns a value with its own data. The operators and the mappings of
+    a space work on internal copy-on-write copies of vector and matrix values, which share the array of their source
+    until one of them is written through the value, see _copy(). Values of array-backed States are never shared
+    """
+    __slots__ = ('name', '_buffer', '_projection', '_shared', '_version')
+
     name: str
     value: object
 
-    def __init__(self, name: str = None):
+    def __init__(self, name: str = None, buffer: np.ndarray = None):
         if not hasattr(self, 'name'):
             self.name = name
+        # Flat float64 view into the buffer of an array-backed State. None if the value owns its data
+        self._buffer = buffer
+        self._projection = None
+        # Copy-on-write: [number of values sharing the array] for internal copies, see _copy(). None if not shared
+        self._shared = None
+        # Taken from _state_versions on every write
+        self._version = 0
 
     def set(self, value):
         ...
@@ -33,8 +94,91 @@ class StateValue(abc.ABC):
     def copy(self):
         return self._copy()
 
-    def _copy(self):
-        return cp.copy(self)
+    def __copy__(self):
+        return self._copy()
+
+    def __deepcopy__(self, memo):
+        cls = type(self)
+        new_value = cls.__new__(cls)
+        memo[id(self)] = new_value
+        for slot in cls._getInstanceSlots():
+            try:
+                value = slot.__get__(self)
+            except AttributeError:
+                continue
+            # Name indices and compiled projections are never written, so they are shared
+            if not isinstance(value, (types.MappingProxyType, Projection)):
+                value = copy.deepcopy(value, memo)
+            slot.__set__(new_value, value)
+        if hasattr(self, '__dict__'):
+            new_value.__dict__.update(copy.deepcopy(self.__dict__, memo))
+        # Arrays that were views into a State buffer are independent copies now
+        new_value._buffer = None
+        new_value._shared = None
+        return new_value
+
+    def _copy(self, share: bool = False):
+        # A copy never shares the buffer of an array-backed State. With share, vector and matrix values share their
+        # array with the copy until one of them is written. Only used for copies that do not leave the space module
+        cls = type(self)
+        new_value = cls.__new__(cls)
+        for slot in cls._getInstanceSlots():
+            try:
+                slot.__set__(new_value, slot.__get__(self))
+            except AttributeError:
+                pass
+        if hasattr(self, '__dict__'):
+            new_value.__dict__.update(self.__dict__)
+        new_value._buffer = None
+        new_value._shared = None
+        return new_value
+
+    @classmethod
+    def _getInstanceSlots(cls) -> tuple:
+        # Slot descriptors that hold instance data, i.e. that are not shadowed by class attributes of a value type
+        slots = cls.__dict__.get('_type_slots')
+        if slots is None:
+            names = {name for klass in cls.__mro__ for name in klass.__dict__.get('__slots__', ())}
+            slots = tuple(getattr(cls, name) for name in sorted(names) if
+                          isinstance(getattr(cls, name, None), types.MemberDescriptorType))
+            cls._type_slots = slots
+        return slots
+
+    def _isShared(self) -> bool:
+        return self._shared is not None and self._shared[0] > 1
+
+    def _share(self, new_value: 'StateValue'):
+        # Lets the copy new_value share the array of this value, see _copy()
+        if self._shared is None:
+            self._shared = [1]
+        self._shared[0] += 1
+        new_value._shared = self._shared
+
+    def _release(self):
+        # Called when the value has its own array again. The last value holding the array then writes it in place
+        if self._shared is not None:
+            self._shared[0] -= 1
+            self._shared = None
+
+    def _detach(self):
+        # Gives a shared value its own array before it is written in place
+        if self._isShared():
+            self.value = self.value.copy()
+        self._release()
+
+    def _attach(self, buffer: np.ndarray):
+        # Makes the value a view into the given slice of a State buffer. The data has to be in the buffer already
+        self._buffer = buffer
+        self._release()
+
+    def _setTrusted(self, values: np.ndarray):
+        # Writes the flat values of this value without conversion or projection, see State.setTrusted
+        if self._isShared():
+            self.value = np.reshape(values, self.value.shape).copy()
+        else:
+            self.value[...] = np.reshape(values, self.value.shape)
+        self._release()
+        self._version = next(_state_versions)
 
     def zero(self):
         ...
@@ -46,9 +190,38 @@ class StateValue(abc.ABC):
     def serialize(self):
         ...
 
+    # ------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def _getTypeProjection(cls) -> 'Projection':
+        # Compiled once per value type, i.e. once per Dimension
+        projection = cls.__dict__.get('_type_projection')
+        if projection is None:
+            projection = Projection(cls)
+            cls._type_projection = projection
+        return projection
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _compileProjection(self) -> 'Projection':
+        # Values that were given their own limits, wrapping or discretization get their own projection
+        cls = type(self)
+        keys = cls.__dict__.get('_type_projection_keys')
+        if keys is None:
+            # Only attributes that are slots of the type can differ per instance
+            keys = tuple((key, _typeAttribute(cls, key, default)) for key, default in
+                         (('shape', None), ('limits', None), ('wrapping', True), ('discretization', None))
+                         if isinstance(getattr(cls, key, None), types.MemberDescriptorType))
+            cls._type_projection_keys = keys
+        for key, type_value in keys:
+            own_value = getattr(self, key, type_value)
+            if own_value is not type_value and not np.array_equal(own_value, type_value):
+                return Projection(self)
+        return cls._getTypeProjection()
+
 
 # ======================================================================================================================
 class ScalarValue(StateValue):
+    __slots__ = ('_value',)
+
     unit: str
     limits: list = None
     wrapping: bool = True
@@ -56,8 +229,8 @@ class ScalarValue(StateValue):
     value: float
 
     def __init__(self, name: str = None, value: float = None, limits: list = None, wrapping: bool = True,
-                 discretization: float = 0):
-        super().__init__(name)
+                 discretization: float = 0, buffer: np.ndarray = None):
+        super().__init__(name, buffer)
         if not hasattr(self, 'limits'):
             self.limits = limits
         if not hasattr(self, 'wrapping'):
@@ -65,6 +238,7 @@ class ScalarValue(StateValue):
         if not hasattr(self, 'discretization'):
             self.discretization = discretization
 
+        self._projection = self._compileProjection()
         self.zero()
 
         if value is not None:
@@ -73,6 +247,28 @@ class ScalarValue(StateValue):
     def serialize(self):
         return self.value
 
+    # ------------------------------------------------------------------------------------------------------------------
+    @property
+    def value(self):
+        if self._buffer is None:
+            return self._value
+        # Python float like an unbacked value, which is also much faster than a numpy scalar in arithmetic. A buffer
+        # stores None as NaN, which is read back as None
+        value = self._buffer.item(0)
+        return None if value != value else value
+
+    @value.setter
+    def value(self, value):
+        if self._buffer is None:
+            self._value = value
+        else:
+            self._buffer[0] = np.nan if value is None else value
+        self._version = next(_state_versions)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _setTrusted(self, values: np.ndarray):
+        self.value = values.item(0)
+
     # ------------------------------------------------------------------------------------------------------------------
     def set(self, value):
         if value is None:
@@ -84,15 +280,8 @@ class ScalarValue(StateValue):
 
         value = float(value)
 
-        if self.limits is not None:
-            if self.wrapping:
-                value = utils.wrap(self.limits, value)
-            else:
-                if not utils.inInterval(self.limits, value):
-                    value = utils.stickToInterval(self.limits, value)
-
-        if self.discretization > 0:
-            value = self.discretization * round(value / self.discretization)
+        if self._projection.active:
+            value = self._projection.applyItem(value)
 
         self.value = value
 
@@ -179,6 +368,12 @@ class ScalarValue(StateValue):
     def _zero(self):
         return 0
 
+    # ------------------------------------------------------------------------------------------------------------------
+    def _copy(self, share: bool = False):
+        new_value = super()._copy()
+        new_value._value = self.value
+        return new_value
+
     # ------------------------------------------------------------------------------------------------------------------
     def _div(self, other, intrinsic):
         if intrinsic:
@@ -246,6 +441,12 @@ class ScalarValue(StateValue):
 
 # ======================================================================================================================
 class VectorValue(StateValue):
+    """
+    1D value. set() writes into the existing array, except for a copy-on-write value that still shares its array with
+    a copy or source, which takes the new array instead (see StateValue)
+    """
+    __slots__ = ('value', 'shape', 'names', 'limits', 'discretization', 'wrapping', 'len', '_name_index')
+
     value: np.ndarray
     shape: tuple
     names: list
@@ -254,8 +455,9 @@ class VectorValue(StateValue):
     len: int
 
     def __init__(self, name: str = None, value: (list, np.ndarray) = None, shape: tuple = None, names: list = None,
-                 limits: list = None, discretization: list = None, wrapping: (list, bool) = True):
-        super().__init__(name)
+                 limits: list = None, discretization: list = None, wrapping: (list, bool) = True,
+                 buffer: np.ndarray = None):
+        super().__init__(name, buffer)
 
         if not hasattr(self, 'limits'):
             self.limits = limits
@@ -270,7 +472,12 @@ class VectorValue(StateValue):
 
         assert (self.shape is not None and len(self.shape) == 1)
         self.len = self.shape[0]
-        self.value = np.ndarray(shape=self.shape)
+        if self._buffer is not None:
+            assert (self._buffer.shape == self.shape)
+            self.value = self._buffer
+        else:
+            self.value = np.ndarray(shape=self.shape)
+        self._projection = self._compileProjection()
         self.zero()
 
         if self.names is None:
@@ -278,22 +485,48 @@ class VectorValue(StateValue):
             for i in range(0, self.len):
                 self.names.append(f"dim_{i}")
 
+        # Values that use the names of their type share one name -> index map
+        if self.names is _typeAttribute(type(self), 'names'):
+            self._name_index = type(self)._getTypeNameIndex()
+        else:
+            self._name_index = {name: i for i, name in enumerate(self.names)}
+
         if value is not None:
             self.set(value)
 
+    # ------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def _getTypeNameIndex(cls) -> dict:
+        name_index = cls.__dict__.get('_type_name_index')
+        if name_index is None:
+            name_index = types.MappingProxyType({name: i for i, name in enumerate(cls.names)})
+            cls._type_name_index = name_index
+        return name_index
+
     # ------------------------------------------------------------------------------------------------------------------
     def set(self, value, index: (int, str) = None):
         if index is None:
-            if isinstance(value, (list, np.ndarray)):
-                for i in range(0, self.len):
-                    self._setItem(value[i], i)
-            elif isinstance(value, VectorValue):
-                for i in range(0, self.len):
-                    self._setItem(value.value[i], i)
+            if isinstance(value, VectorValue):
+                value = value.value
+            elif isinstance(value, list):
+                value = [item.value if isinstance(item, StateValue) else item for item in value]
+            elif not isinstance(value, np.ndarray):
+                return
+
+            new_value = np.array(value[0:self.len], dtype=float)
+            if self._projection.active:
+                self._projection.apply(new_value)
+            if self._isShared():
+                # The new array is private anyway, so a shared value just takes it instead of writing into the source
+                self.value = new_value
+            else:
+                self.value[:] = new_value
+            self._release()
+            self._version = next(_state_versions)
         elif isinstance(index, int):
             self._setItem(value, index)
         elif isinstance(index, str):
-            dim_index = self.names.index(index)
+            dim_index = self._name_index[index]
             self._setItem(value, dim_index)
 
     # ------------------------------------------------------------------------------------------------------------------
@@ -303,7 +536,7 @@ class VectorValue(StateValue):
         elif isinstance(index, int):
             return self.value[index]
         elif isinstance(index, str):
-            dim_index = self.names.index(index)
+            dim_index = self._name_index[index]
             return self.value[dim_index]
 
     # ------------------------------------------------------------------------------------------------------------------
@@ -320,25 +553,12 @@ class VectorValue(StateValue):
             value = value.value
         value = float(value)
 
-        if self.limits is not None:
-            wrap = False
-            if self.wrapping is not None:
-                if isinstance(self.wrapping, bool):
-                    wrap = self.wrapping
-                elif isinstance(self.wrapping, list):
-                    wrap = self.wrapping[index]
-            if wrap:
-                value = utils.wrap(self.limits[index], value)
-            else:
-                if not utils.inInterval(self.limits[index], value):
-                    value = utils.stickToInterval(self.limits[index], value)
-
-        if self.discretization is not None:
-            if self.discretization[index] is not None:
-                if self.discretization[index] > 0:
-                    value = self.discretization[index] * round(value / self.discretization[index])
+        if self._projection.active:
+            value = self._projection.applyItem(value, index)
 
+        self._detach()
         self.value[index] = value
+        self._version = next(_state_versions)
 
     # ------------------------------------------------------------------------------------------------------------------
     def add(self, other):
@@ -377,7 +597,7 @@ class VectorValue(StateValue):
         if intrinsic:
             new_value = self
         else:
-            new_value = self.copy()
+            new_value = self._copy(share=True)
         # Case 1: Other value is also a vector in the same dimension
         if isinstance(other, VectorValue) and other.shape == self.shape:
             new_value.set(self.value + other.value)
@@ -400,7 +620,7 @@ class VectorValue(StateValue):
         if intrinsic:
             new_value = self
         else:
-            new_value = self.copy()
+            new_value = self._copy(share=True)
         # Case 1: Other value is also a vector in the same dimension
         if isinstance(other, VectorValue) and other.shape == self.shape:
             new_value.set(self.value - other.value)
@@ -423,7 +643,7 @@ class VectorValue(StateValue):
         if intrinsic:
             new_value = self
         else:
-            new_value = self.copy()
+            new_value = self._copy(share=True)
 
         # Case 1: Other Value is a ScalarValue
         if isinstance(other, ScalarValue):
@@ -447,7 +667,7 @@ class VectorValue(StateValue):
         if intrinsic:
             new_value = self
         else:
-            new_value = self.copy()
+            new_value = self._copy(share=True)
 
         # Case 1: Other Value is a ScalarValue
         if isinstance(other, ScalarValue):
@@ -463,7 +683,7 @@ class VectorValue(StateValue):
 
     # ------------------------------------------------------------------------------------------------------------------
     def _rsub(self, other):
-        new_value = self.copy()
+        new_value = self._copy(share=True)
         # Case 1: Other value is also a vector in the same dimension
         if isinstance(other, VectorValue) and other.shape == self.shape:
             new_value.set(other.value - other.value)
@@ -482,12 +702,22 @@ class VectorValue(StateValue):
         raise Exception()
 
     # ------------------------------------------------------------------------------------------------------------------
-    def _copy(self):
-        new_value = cp.copy(self)
-        new_value.value = np.ndarray(new_value.shape)
-        new_value.set(self.value)
+    def _copy(self, share: bool = False):
+        new_value = super()._copy()
+        if share and self._buffer is None:
+            # Copy-on-write: both sides share the array until one of them is written, the written side takes a new
+            # array. In-place writes to .value bypass this, so shared copies are never handed out
+            self._share(new_value)
+        else:
+            # The values of an array-backed State are already projected
+            new_value.value = self.value.copy()
         return new_value
 
+    # ------------------------------------------------------------------------------------------------------------------
+    def _attach(self, buffer: np.ndarray):
+        super()._attach(buffer)
+        self.value = buffer
+
     # ------------------------------------------------------------------------------------------------------------------
     def __add__(self, other):
         return self.add(other)
@@ -563,18 +793,28 @@ class VectorValue(StateValue):
 
 # ======================================================================================================================
 class MatrixValue(StateValue):
+    """
+    2D value. set() takes the given array instead of writing into the existing one, unless the value is array-backed.
+    Item writes of a value that shares its array copy it first (see StateValue)
+    """
+    __slots__ = ('value', 'shape')
+
     value: np.ndarray
     shape: tuple
 
-    def __init__(self, name: str = None, shape: tuple = None, value: (list, np.ndarray) = None):
-        super().__init__(name)
+    def __init__(self, name: str = None, shape: tuple = None, value: (list, np.ndarray) = None,
+                 buffer: np.ndarray = None):
+        super().__init__(name, buffer)
 
         if not hasattr(self, 'shape'):
             self.shape = shape
 
         assert (self.shape is not None and isinstance(self.shape, tuple))
 
-        self.value = np.ndarray(shape=self.shape)
+        if self._buffer is not None:
+            self.value = self._buffer.reshape(self.shape)
+        else:
+            self.value = np.ndarray(shape=self.shape)
         self.zero()
 
         if value is not None:
@@ -586,15 +826,27 @@ class MatrixValue(StateValue):
             if isinstance(value, list):
                 new_value = np.asarray(value)
                 assert (new_value.shape == self.shape)
-                self.value = new_value
+                self._assign(new_value)
             elif isinstance(value, np.ndarray):
                 assert (value.shape == self.shape)
-                self.value = value
+                self._assign(value)
             elif isinstance(value, MatrixValue):
                 assert (value.shape == self.shape)
-                self.value = value.value
+                self._assign(value.value)
         elif isinstance(index, tuple):
+            self._detach()
             self.value[index] = value
+            self._version = next(_state_versions)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _assign(self, value: np.ndarray):
+        # Array-backed values have to stay a view into the State's buffer, so they are written in place
+        if self._buffer is not None:
+            self.value[...] = value
+        else:
+            self.value = value
+            self._release()
+        self._version = next(_state_versions)
 
     # ------------------------------------------------------------------------------------------------------------------
     def zero(self):
@@ -640,7 +892,7 @@ class MatrixValue(StateValue):
         if intrinsic:
             new_value = self
         else:
-            new_value = self.copy()
+            new_value = self._copy(share=True)
 
         # Case 1: Other value is also a matrix in the same dimension
         if isinstance(other, MatrixValue) and other.shape == self.shape:
@@ -664,7 +916,7 @@ class MatrixValue(StateValue):
         if intrinsic:
             new_value = self
         else:
-            new_value = self.copy()
+            new_value = self._copy(share=True)
 
         # Case 1: Other value is also a matrix in the same dimension
         if isinstance(other, MatrixValue) and other.shape == self.shape:
@@ -685,7 +937,7 @@ class MatrixValue(StateValue):
 
     # ------------------------------------------------------------------------------------------------------------------
     def _rsub(self, other):
-        new_value = self.copy()
+        new_value = self._copy(share=True)
 
         # Case 1: Other value is also a matrix in the same dimension
         if isinstance(other, MatrixValue) and other.shape == self.shape:
@@ -709,7 +961,7 @@ class MatrixValue(StateValue):
         if intrinsic:
             new_value = self
         else:
-            new_value = self.copy()
+            new_value = self._copy(share=True)
 
         # Case 1: Other Value is a ScalarValue
         if isinstance(other, ScalarValue):
@@ -733,7 +985,7 @@ class MatrixValue(StateValue):
 
         # Case 5: Other is a VectorValue
         if isinstance(other, VectorValue):
-            new_value = other.copy()
+            new_value = other._copy(share=True)
             new_value.set(self.value @ other.value)
             return new_value
 
@@ -750,7 +1002,7 @@ class MatrixValue(StateValue):
 
     # ------------------------------------------------------------------------------------------------------------------
     def _rmul(self, other):
-        new_value = self.copy()
+        new_value = self._copy(share=True)
 
         # Case 1: Other Value is a ScalarValue
         if isinstance(other, ScalarValue):
@@ -775,12 +1027,22 @@ class MatrixValue(StateValue):
         raise Exception
 
     # ------------------------------------------------------------------------------------------------------------------
-    def _copy(self):
-        new_value = cp.copy(self)
-        new_value.value = np.ndarray(new_value.shape)
-        new_value.set(self.value)
+    def _copy(self, share: bool = False):
+        new_value = super()._copy()
+        if share and self._buffer is None:
+            # Copy-on-write: both sides share the array until one of them is written, the written side takes a new
+            # array. In-place writes to .value bypass this, so shared copies are never handed out
+            self._share(new_value)
+        else:
+            # The values of an array-backed State are already projected
+            new_value.value = self.value.copy()
         return new_value
 
+    # ------------------------------------------------------------------------------------------------------------------
+    def _attach(self, buffer: np.ndarray):
+        super()._attach(buffer)
+        self.value = buffer.reshape(self.shape)
+
     # ------------------------------------------------------------------------------------------------------------------
     def __add__(self, other):
         return self.add(other)
@@ -849,6 +1111,98 @@ class MatrixValue(StateValue):
         return self.value.tolist()
 
 
+# ======================================================================================================================
+class Projection:
+    """
+    Limits, wrapping and discretization of a value type compiled into flat arrays, so that they can be applied to
+    whole arrays of values at once. Works on arrays of shape (..., size)
+    """
+    size: int
+    active: bool
+
+    def __init__(self, value: (type, StateValue)):
+        value_type = value if isinstance(value, type) else type(value)
+        limits = _typeAttribute(value, 'limits', None)
+        wrapping = _typeAttribute(value, 'wrapping', True)
+        discretization = _typeAttribute(value, 'discretization', None)
+
+        if issubclass(value_type, ScalarValue):
+            self.size = 1
+            limits = [limits] if limits is not None else None
+            wrapping = [bool(wrapping)]
+            discretization = [discretization]
+        elif issubclass(value_type, VectorValue):
+            self.size = _typeAttribute(value, 'shape')[0]
+            if not isinstance(wrapping, list):
+                wrapping = [bool(wrapping)] * self.size
+        else:
+            shape = _typeAttribute(value, 'shape', None)
+            self.size = int(np.prod(shape)) if shape is not None else 1
+            limits = None
+            discretization = None
+
+        wrap = np.zeros(self.size, dtype=bool)
+        lower = np.full(self.size, -np.inf)
+        upper = np.full(self.size, np.inf)
+        if limits is not None:
+            for i, interval in enumerate(limits):
+                lower[i], upper[i] = interval
+                wrap[i] = wrapping[i]
+
+        step = np.zeros(self.size)
+        if discretization is not None:
+            for i, value_step in enumerate(discretization):
+                if value_step is not None and value_step > 0:
+                    step[i] = value_step
+
+        self.wrap_index = np.flatnonzero(wrap & np.isfinite(lower))
+        self.wrap_lower = lower[self.wrap_index]
+        self.wrap_width = upper[self.wrap_index] - lower[self.wrap_index]
+
+        self.clip_index = np.flatnonzero(~wrap & (np.isfinite(lower) | np.isfinite(upper)))
+        self.clip_lower = lower[self.clip_index]
+        self.clip_upper = upper[self.clip_index]
+
+        self.discrete_index = np.flatnonzero(step)
+        self.discrete_step = step[self.discrete_index]
+
+        self.active = len(self.wrap_index) > 0 or len(self.clip_index) > 0 or len(self.discrete_index) > 0
+
+        # Plain floats for projecting single items, where NumPy would be slower than math
+        self.items = [(bool(wrap[i] and np.isfinite(lower[i])), bool(not wrap[i] and i in self.clip_index),
+                       float(lower[i]), float(upper[i]), float(upper[i] - lower[i]), float(step[i]))
+                      for i in range(0, self.size)]
+
+    def applyItem(self, value: float, index: int = 0) -> float:
+        """
+        Projects a single float, e.g. a scalar value or one element of a vector
+        """
+        wrap, clip, lower, upper, width, step = self.items[index]
+        if wrap:
+            value = lower + math.fmod(width + math.fmod(value - lower, width), width)
+        elif clip:
+            value = min(max(value, lower), upper)
+        if step > 0:
+            value = step * round(value / step)
+        return value
+
+    def apply(self, value: np.ndarray) -> np.ndarray:
+        """
+        Projects the given array in place
+        """
+        if len(self.wrap_index) > 0:
+            # Same formula as utils.wrap, so that single values and arrays are projected identically
+            value[..., self.wrap_index] = self.wrap_lower + np.fmod(
+                self.wrap_width + np.fmod(value[..., self.wrap_index] - self.wrap_lower, self.wrap_width),
+                self.wrap_width)
+        if len(self.clip_index) > 0:
+            value[..., self.clip_index] = np.clip(value[..., self.clip_index], self.clip_lower, self.clip_upper)
+        if len(self.discrete_index) > 0:
+            value[..., self.discrete_index] = self.discrete_step * np.round(
+                value[..., self.discrete_index] / self.discrete_step)
+        return value
+
+
 # ======================================================================================================================
 class Dimension:
     base_type: type
@@ -869,7 +1223,7 @@ class Dimension:
         if base_type is not None:
             self.base_type = base_type
         self.value_type = type(self.name, (self.base_type,),
-                               {**{'name': self.name, 'limits': self.limits}, **self.kwargs})
+                               {**{'__slots__': (), 'name': self.name, 'limits': self.limits}, **self.kwargs})
 
     @property
     def limits(self):
@@ -879,10 +1233,22 @@ class Dimension:
     def limits(self, value):
         self._limits = value
         self.value_type = type(self.name, (self.base_type,),
-                               {**{'name': self.name, 'limits': self.limits}, **self.kwargs})
+                               {**{'__slots__': (), 'name': self.name, 'limits': self.limits}, **self.kwargs})
 
-    def getValue(self, value=None) -> StateValue:
-        val = self.value_type()
+    @property
+    def projection(self) -> Projection:
+        return self.value_type._getTypeProjection()
+
+    @property
+    def size(self) -> int:
+        # Number of floats this dimension occupies in the flat buffer of an array-backed State
+        shape = _typeAttribute(self.value_type, 'shape', None)
+        if shape is None:
+            return 1
+        return int(np.prod(shape))
+
+    def getValue(self, value=None, buffer: np.ndarray = None) -> StateValue:
+        val = self.value_type(buffer=buffer)
         if value is not None:
             val.set(value)
         return val
@@ -899,8 +1265,8 @@ class ScalarDimension(Dimension):
     def __init__(self, name: str = None, base_type=None, **kwargs):
         super().__init__(name, base_type, **kwargs)
 
-    def getValue(self, value=None) -> ScalarValue:
-        return super().getValue(value)
+    def getValue(self, value=None, buffer: np.ndarray = None) -> ScalarValue:
+        return super().getValue(value, buffer)
 
 
 # ======================================================================================================================
@@ -911,8 +1277,8 @@ class VectorDimension(Dimension):
     def __init__(self, name: str = None, base_type=None, **kwargs):
         super().__init__(name, base_type, **kwargs)
 
-    def getValue(self, value=None) -> ScalarValue:
-        return super().getValue(value)
+    def getValue(self, value=None, buffer: np.ndarray = None) -> ScalarValue:
+        return super().getValue(value, buffer)
 
     def __iter__(self):
         return iter(self.base_type.names)
@@ -926,19 +1292,145 @@ class MatrixDimension(Dimension):
     def __init__(self, name: str = None, base_type=None, **kwargs):
         super().__init__(name, base_type, **kwargs)
 
-    def getValue(self, value=None) -> ScalarValue:
-        return super().getValue(value)
+    def getValue(self, value=None, buffer: np.ndarray = None) -> ScalarValue:
+        return super().getValue(value, buffer)
 
 
 # ======================================================================================================================
-class Space:
+_mapping_version = 0  # Incremented whenever the mappings or parents of spaces change. Invalidates all mapping caches
+
+MAPPING_IDENTITY = 'identity'  # Resolution: states are copied into the target space
+MAPPING_PARENT = 'parent'  # Resolution: states are relative to the target space and are added to the origin
+
+
+def invalidateMappingCaches():
+    global _mapping_version
+    _mapping_version += 1
+
+
+# ======================================================================================================================
+class MappingList(list):
+    """
+    List of SpaceMappings that invalidates the mapping caches of all spaces whenever it is modified
+    """
+
+    def append(self, mapping):
+        super().append(mapping)
+        invalidateMappingCaches()
+
+    def extend(self, mappings):
+        super().extend(mappings)
+        invalidateMappingCaches()
+
+    def insert(self, index, mapping):
+        super().insert(index, mapping)
+        invalidateMappingCaches()
+
+    def remove(self, mapping):
+        super().remove(mapping)
+        invalidateMappingCaches()
+
+    def pop(self, index=-1):
+        mapping = super().pop(index)
+        invalidateMappingCaches()
+        return mapping
+
+    def clear(self):
+        super().clear()
+        invalidateMappingCaches()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        invalidateMappingCaches()
+
+    def reverse(self):
+        super().reverse()
+        invalidateMappingCaches()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        invalidateMappingCaches()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        invalidateMappingCaches()
+
+    def __iadd__(self, other):
+        out = super().__iadd__(other)
+        invalidateMappingCaches()
+        return out
+
+
+# ======================================================================================================================
+class SpaceLayout:
+    """
+    Frozen name -> index, slice and shape maps of a list of dimensions and the size of their flat layout
+    """
+    __slots__ = ('dimensions', 'index', 'slices', 'shapes', 'size', 'accessor_type')
+
+    def __init__(self, dimensions: list[Dimension]):
+        index = {}
+        slices = {}
+        shapes = {}
+        offset = 0
+        for i, dim in enumerate(dimensions):
+            index[dim.name] = i
+            slices[dim.name] = slice(offset, offset + dim.size)
+            shapes[dim.name] = _typeAttribute(dim.value_type, 'shape', None)
+            offset += dim.size
+
+        self.dimensions = dimensions
+        self.index = types.MappingProxyType(index)
+        self.slices = types.MappingProxyType(slices)
+        self.shapes = types.MappingProxyType(shapes)
+        self.size = offset
+        self.accessor_type = None  # Compiled on first use, see compileSpace
+
+
+# ======================================================================================================================
+class SpaceType(type):
+    """
+    Metaclass of Space. Makes sure that mappings assigned on the class (e.g. Space2D.mappings = [...]) are a
+    MappingList and invalidate the mapping caches, and builds the layout of the dimensions defined on the class
+    """
+
+    def __init__(cls, name, bases, namespace):
+        super().__init__(name, bases, namespace)
+        if isinstance(namespace.get('mappings'), list):
+            type.__setattr__(cls, 'mappings', MappingList(namespace['mappings']))
+
+        dimensions = getattr(cls, 'dimensions', None)
+        if isinstance(dimensions, list) and all(isinstance(dim, Dimension) for dim in dimensions):
+            type.__setattr__(cls, '_layout', SpaceLayout(dimensions))
+
+    def __setattr__(cls, name, value):
+        if name == 'mappings' and isinstance(value, list) and not isinstance(value, MappingList):
+            value = MappingList(value)
+        super().__setattr__(name, value)
+        if name == 'mappings':
+            invalidateMappingCaches()
+
+
+# ======================================================================================================================
+class Space(metaclass=SpaceType):
     dimensions: list[Dimension]
     mappings: list['SpaceMapping']
 
     parent: 'Space'
     origin: 'State'
 
-    def __init__(self, dimensions: (int, list) = None, parent: 'Space' = None, origin=None):
+    array_backed: bool = False  # States of this space store all values in one contiguous float64 buffer
+    layout: 'SpaceLayout'
+    dimension_index: types.MappingProxyType  # Dimension name -> position in self.dimensions
+    dimension_slices: types.MappingProxyType  # Dimension name -> slice into the flat buffer of an array-backed State
+    dimension_shapes: types.MappingProxyType  # Dimension name -> shape of the value. None for scalar dimensions
+    size: int  # Length of the flat buffer
+
+    map_cache_hits: int
+    map_cache_misses: int
+
+    def __init__(self, dimensions: (int, list) = None, parent: 'Space' = None, origin=None,
+                 array_backed: bool = None):
         if not hasattr(self, 'dimensions'):
             self.dimensions = []
 
@@ -955,6 +1447,11 @@ class Space:
         if not hasattr(self, 'mappings'):
             self.mappings = []
 
+        if array_backed is not None:
+            self.array_backed = array_backed
+
+        self._buildIndex()
+
         self.parent = parent
 
         if self.parent is not None and origin is None:
@@ -964,9 +1461,27 @@ class Space:
         else:
             self.origin = None
 
+        # Resolved mappings from other spaces into this space, see _resolveMapping
+        self.map_cache_hits = 0
+        self.map_cache_misses = 0
+        self._map_cache_version = _mapping_version
+        self._map_cache = {}
+        # Chains of mappings that map() may use, see useMappingChain
+        self._mapping_chains = {}
+
+    # === PROPERTIES ===================================================================================================
+    @property
+    def _trusted(self) -> int:
+        # Depth of the trusted() blocks of this space in the current thread. Writes of the space are not validated
+        # inside them. Kept per thread, so that parallel actions do not see the trusted blocks of each other
+        depths = getattr(_thread_state, 'trusted', None)
+        if not depths:
+            return 0
+        return depths.get(id(self), 0)
+
     # === METHODS ======================================================================================================
-    def getState(self, value=None):
-        return State(space=self, value=value)
+    def getState(self, value=None, buffer: np.ndarray = None):
+        return State(space=self, value=value, buffer=buffer)
 
     # ------------------------------------------------------------------------------------------------------------------
     def map(self, value: ('State', list, np.ndarray, int, float)):
@@ -974,32 +1489,26 @@ class Space:
         if value is None:
             return None
 
+        # Condition 0: value is a batch of states
+        if isinstance(value, StateBatch):
+            return self._mapBatch(value)
+
         # Condition 1: value is of class 'State' and from this space
         if isinstance(value, State) and value.space == self:
-            return self.getState(value=value.value)
+            return value.copy()
 
         # Condition 2: value is of class 'State' from another space
         if isinstance(value, State) and value.space != self:
-            # The other space knows a mapping to this space
-            if value.space.hasMapping(self):
-                mapping = next(mapping for mapping in value.space.mappings if
-                               (mapping.space_to == self or isinstance(self, mapping.space_to)))
-                return mapping.map(value, self)
+            resolution = self._resolveMapping(value.space)
+            if resolution is MAPPING_IDENTITY:
+                return self.getState(value=value.value)
             # The value has this state as a parent and is from the same class
-            elif type(value.space) == type(self) and value.space.parent == self:
+            elif resolution is MAPPING_PARENT:
                 out = self.getState(value=value.value)
                 out = value.space.origin + out
                 return out
-            elif type(value.space) == type(self):
-                out = self.getState(value=value.value)
-                return out
-            # This space knows a mapping from the other space to this space
-            elif self.hasMapping(space_to=self, space_from=value.space):
-                mapping = next((mapping for mapping in self.mappings if
-                                (mapping.space_to == self or isinstance(self, mapping.space_to)) and (
-                                            mapping.space_from == value.space or isinstance(value.space,
-                                                                                            mapping.space_from))))
-                return mapping.map(value, self)
+            elif resolution is not None:
+                return resolution.map(value, self)
 
         # Condition 3: value is a list of the correct length
         if isinstance(value, list) and len(value) == len(self.dimensions):
@@ -1007,6 +1516,10 @@ class Space:
 
         # Condition 4: value is a ndarray of the correct length
         if isinstance(value, np.ndarray) and value.shape == (len(self.dimensions),):
+            if self._trusted and self.size == len(self.dimensions):
+                state = self.getState()
+                state.setTrusted(value)
+                return state
             value = value.tolist()
             return self.getState(value=value)
 
@@ -1016,23 +1529,81 @@ class Space:
 
         raise Exception("Cannot map the state")
 
+    # ------------------------------------------------------------------------------------------------------------------
+    def map_into(self, value: ('State', list, np.ndarray, int, float), out: 'State') -> 'State':
+        """
+        Same as map(), but writes the result into the existing State out of this space instead of creating a new
+        State. Returns out. Hot paths can keep one output State and map into it every time
+        """
+        if value is None:
+            return None
+
+        if out.space is not self:
+            raise Exception("Output state is not from this space")
+
+        if isinstance(value, State):
+            if value.space == self:
+                out.set(value)
+                return out
+
+            resolution = self._resolveMapping(value.space)
+            if resolution is MAPPING_IDENTITY:
+                out.set(value)
+                return out
+            elif resolution is MAPPING_PARENT:
+                out.set(value)
+                out.set(value.space.origin + out)
+                return out
+            elif resolution is not None:
+                return resolution.map_into(value, out)
+
+        if isinstance(value, list) and len(value) == len(self.dimensions):
+            out.set(value)
+            return out
+
+        if isinstance(value, np.ndarray) and value.shape == (len(self.dimensions),):
+            out.set(value.tolist())
+            return out
+
+        if isinstance(value, (int, float)) and len(self.dimensions) == 1:
+            out.set(value)
+            return out
+
+        raise Exception("Cannot map the state")
+
     # ------------------------------------------------------------------------------------------------------------------
     def add(self, value1, value2):
+        if isinstance(value1, StateBatch) or isinstance(value2, StateBatch):
+            return self._batchOperation(self._addBatch, value1, value2, None)
+        if self._trusted and self._isFlatOperand(value1) and self._isFlatOperand(value2):
+            return self._trustedOperation(self._addBatch, value1, value2, False)
         value1_map, value2_map, new_state = self._mapOperators(value1, value2, False)
         return self._add(value1_map, value2_map, new_state)
 
     # ------------------------------------------------------------------------------------------------------------------
     def iadd(self, value1, value2):
+        if isinstance(value1, StateBatch):
+            return self._batchOperation(self._addBatch, value1, value2, value1)
+        if self._trusted and self._isFlatOperand(value1) and self._isFlatOperand(value2):
+            return self._trustedOperation(self._addBatch, value1, value2, True)
         value1_map, value2_map, new_state = self._mapOperators(value1, value2, True)
         return self._add(value1_map, value2_map, new_state)
 
     # ------------------------------------------------------------------------------------------------------------------
     def sub(self, value1, value2):
+        if isinstance(value1, StateBatch) or isinstance(value2, StateBatch):
+            return self._batchOperation(self._subBatch, value1, value2, None)
+        if self._trusted and self._isFlatOperand(value1) and self._isFlatOperand(value2):
+            return self._trustedOperation(self._subBatch, value1, value2, False)
         value1_map, value2_map, new_state = self._mapOperators(value1, value2, False)
         return self._sub(value1_map, value2_map, new_state)
 
     # ------------------------------------------------------------------------------------------------------------------
     def isub(self, value1, value2):
+        if isinstance(value1, StateBatch):
+            return self._batchOperation(self._subBatch, value1, value2, value1)
+        if self._trusted and self._isFlatOperand(value1) and self._isFlatOperand(value2):
+            return self._trustedOperation(self._subBatch, value1, value2, True)
         value1_map, value2_map, new_state = self._mapOperators(value1, value2, True)
         return self._sub(value1_map, value2_map, new_state)
 
@@ -1059,8 +1630,56 @@ class Space:
         ...
 
     # ------------------------------------------------------------------------------------------------------------------
-    def addMapping(self):
-        ...
+    def addMapping(self, mapping: 'SpaceMapping'):
+        self.mappings.append(mapping)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def removeMapping(self, mapping: 'SpaceMapping'):
+        self.mappings.remove(mapping)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def getMappingChain(self, space_from: 'Space', max_hops: int = 4) -> 'MappingChain':
+        return MappingChain.find(space_from=space_from, space_to=self, max_hops=max_hops)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def useMappingChain(self, space_from: 'Space', max_hops: int = 4) -> 'MappingChain':
+        """
+        Lets map() use the shortest chain of mappings from space_from to this space if there is no direct mapping.
+        Chains are only used after this call, since the spaces in between may be instantiated with default arguments
+        """
+        chain = self.getMappingChain(space_from, max_hops)
+        if chain is None:
+            raise Exception(f"No chain of mappings from {type(space_from).__name__} to {type(self).__name__}")
+        self._mapping_chains[space_from] = chain
+        invalidateMappingCaches()
+        return chain
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def getSchema(self) -> dict:
+        """
+        Description of the flat layout of the states of this space, which is needed to decode encoded states
+        """
+        dimensions = []
+        for dim in self.dimensions:
+            shape = self.dimension_shapes[dim.name]
+            dimensions.append({'name': dim.name,
+                               'offset': self.dimension_slices[dim.name].start,
+                               'shape': list(shape) if shape is not None else None,
+                               'names': _typeAttribute(dim.value_type, 'names', None) if shape is not None else None})
+        return {'space': type(self).__name__, 'size': self.size, 'dimensions': dimensions}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def decode(self, data: (bytes, np.ndarray)) -> 'State':
+        # Inverse of State.encode()
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = np.frombuffer(data, dtype=ENCODING_DTYPE)
+        return self.getState(buffer=np.array(data, dtype=float))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def clearMapCache(self):
+        self._map_cache = {}
+        self.map_cache_hits = 0
+        self.map_cache_misses = 0
 
     # ------------------------------------------------------------------------------------------------------------------
     def hasMapping(self, space_to: 'Space', space_from: 'Space' = None):
@@ -1076,13 +1695,98 @@ class Space:
         if isinstance(index, int):
             return self.dimensions[index]
         elif isinstance(index, str):
-            dimension = next((dim for dim in self.dimensions if dim.name == index), None)
-            return dimension
+            dim_index = self.dimension_index.get(index)
+            if dim_index is None:
+                return None
+            return self.dimensions[dim_index]
 
     def hasDimension(self, name) -> bool:
-        return any(dim for dim in self.dimensions if dim.name == name)
+        return name in self.dimension_index
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def getAccessorType(self) -> type:
+        return compileSpace(self)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def getAccessor(self, state: 'State' = None) -> 'StateAccessor':
+        """
+        Accessor with named properties for the dimensions of this space. For an array-backed state it works on the
+        buffer of the state without copying. For any other state it works on a copy of the values
+        """
+        accessor_type = compileSpace(self)
+        if state is None:
+            return accessor_type()
+        return accessor_type.from_array(state.asArray())
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def getBatch(self, value=None, n: int = None) -> 'StateBatch':
+        return StateBatch(space=self, value=value, n=n)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @contextlib.contextmanager
+    def trusted(self):
+        """
+        Context manager for inner loops whose producer guarantees valid values, e.g. the integration of a dynamics.
+        Inside it, additions and subtractions of States and flat arrays of this space and setArray() are written
+        with State.setTrusted(), i.e. without conversion, limits, wrapping and discretization
+        """
+        depths = getattr(_thread_state, 'trusted', None)
+        if depths is None:
+            depths = _thread_state.trusted = {}
+        key = id(self)
+        depths[key] = depths.get(key, 0) + 1
+        try:
+            yield self
+        finally:
+            if depths[key] == 1:
+                del depths[key]
+            else:
+                depths[key] -= 1
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def project(self, values: np.ndarray) -> np.ndarray:
+        """
+        Applies limits, wrapping and discretization of all dimensions to an array of flat states in place
+        :param values: ndarray of shape (N, size)
+        """
+        for dim, dim_slice in zip(self.dimensions, self.dimension_slices.values()):
+            projection = dim.projection
+            if projection.active:
+                projection.apply(values[:, dim_slice])
+        return values
 
     # === PRIVATE METHODS ==============================================================================================
+    def _buildIndex(self):
+        # Spaces that use the dimensions of their class share the layout that was built with the class
+        layout = type(self).__dict__.get('_layout')
+        if layout is None or layout.dimensions is not self.dimensions:
+            layout = SpaceLayout(self.dimensions)
+        self.layout = layout
+        self.dimension_index = layout.index
+        self.dimension_slices = layout.slices
+        self.dimension_shapes = layout.shapes
+        self.size = layout.size
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _isFlatOperand(self, value) -> bool:
+        return (isinstance(value, State) and value.space is self) or (
+                isinstance(value, np.ndarray) and value.shape == (self.size,))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _trustedOperation(self, operation, value1, value2, intrinsic):
+        # Operation on the flat values like for batches, the result is written without validation
+        values = operation(np.asarray(value1, dtype=float)[np.newaxis, :],
+                           np.asarray(value2, dtype=float)[np.newaxis, :])[0]
+        if intrinsic and isinstance(value1, State):
+            new_state = value1
+        elif isinstance(value1, State):
+            new_state = value1._copy(share=True)
+        else:
+            new_state = self.getState()
+        new_state.setTrusted(values)
+        return new_state
+
+    # ------------------------------------------------------------------------------------------------------------------
     def _mapOperators(self, value1, value2, intrinsic):
         if intrinsic:
             new_state = value1
@@ -1090,17 +1794,107 @@ class Space:
             new_state = self.getState()
 
         try:
-            value1_map = self.map(value1)
+            value1_map = self._mapOperand(value1)
         except:
             value1_map = None
 
         try:
-            value2_map = self.map(value2)
+            value2_map = self._mapOperand(value2)
         except:
             value2_map = None
 
         return value1_map, value2_map, new_state
 
+    # ------------------------------------------------------------------------------------------------------------------
+    def _mapOperand(self, value):
+        # The operands are only read, so states of this space are taken as copy-on-write copies instead of full copies
+        if isinstance(value, State) and value.space == self:
+            return value._copy(share=True)
+        return self.map(value)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _resolveMapping(self, space_from: 'Space'):
+        """
+        Returns how states of space_from are mapped into this space: MAPPING_IDENTITY, MAPPING_PARENT, a SpaceMapping
+        or None if there is no way. The result is cached per source space until any mapping or parent changes
+        """
+        if self._map_cache_version != _mapping_version:
+            self._map_cache = {}
+            self._map_cache_version = _mapping_version
+
+        resolution = self._map_cache.get(space_from, self._map_cache)
+        if resolution is not self._map_cache:
+            self.map_cache_hits += 1
+            return resolution
+
+        self.map_cache_misses += 1
+        resolution = self._findMapping(space_from)
+        self._map_cache[space_from] = resolution
+        return resolution
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _findMapping(self, space_from: 'Space'):
+        if space_from == self:
+            return MAPPING_IDENTITY
+
+        # The other space knows a mapping to this space
+        if space_from.hasMapping(self):
+            return next(mapping for mapping in space_from.mappings if
+                        (mapping.space_to == self or isinstance(self, mapping.space_to)))
+        # The other space has this space as a parent and is from the same class
+        elif type(space_from) == type(self) and space_from.parent == self:
+            return MAPPING_PARENT
+        elif type(space_from) == type(self):
+            return MAPPING_IDENTITY
+        # This space knows a mapping from the other space to this space
+        elif self.hasMapping(space_to=self, space_from=space_from):
+            return next((mapping for mapping in self.mappings if
+                         (mapping.space_to == self or isinstance(self, mapping.space_to)) and (
+                                 mapping.space_from == space_from or isinstance(space_from,
+                                                                                mapping.space_from))), None)
+        # There is no direct mapping. A chain over other spaces is only used if it was set with useMappingChain
+        return self._mapping_chains.get(space_from)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _mapBatch(self, batch: 'StateBatch') -> 'StateBatch':
+        # Same logic as map(), applied to a whole batch
+        resolution = self._resolveMapping(batch.space)
+
+        if resolution is MAPPING_IDENTITY:
+            return StateBatch(space=self, value=batch.value.copy())
+        elif resolution is MAPPING_PARENT:
+            return batch.space.origin + StateBatch(space=self, value=batch.value.copy())
+        elif resolution is not None:
+            return resolution.mapBatch(batch, self)
+
+        raise Exception("Cannot map the batch")
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _batchOperand(self, value) -> np.ndarray:
+        # Returns the operand as array of shape (N, size) or (1, size) in this space
+        if isinstance(value, StateBatch):
+            if value.space is not self:
+                value = self.map(value)
+            return value.value
+        return self.map(value).asArray()[np.newaxis, :]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _batchOperation(self, operation, value1, value2, out: 'StateBatch'):
+        values = operation(self._batchOperand(value1), self._batchOperand(value2))
+        self.project(values)
+        if out is None:
+            return StateBatch(space=self, value=values)
+        out.value[:] = values
+        return out
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _addBatch(self, values1: np.ndarray, values2: np.ndarray) -> np.ndarray:
+        return values1 + values2
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _subBatch(self, values1: np.ndarray, values2: np.ndarray) -> np.ndarray:
+        return values1 - values2
+
     # ------------------------------------------------------------------------------------------------------------------
     def _mul(self, state1, state2, value1, value2, new_state):
 
@@ -1119,17 +1913,13 @@ class Space:
             # Case 1.2: value2 is a matrix and this space is only consisting of scalar values
             if isinstance(value2, np.ndarray) and value2.shape == (len(self.dimensions), len(self.dimensions)) and all(
                     isinstance(dim, ScalarDimension) for dim in self.dimensions):
-                own_value = np.asarray([dim.value for dim in state1.value])
-
-                return value2 @ own_value
+                return value2 @ state1.asArray()
 
             # Case 1.3
             if isinstance(value2, np.ndarray) and len(value2.shape) == 2 and value2.shape[1] == len(
                     self.dimensions) and all(
                 isinstance(dim, ScalarDimension) for dim in self.dimensions):
-                own_value = np.asarray([dim.value for dim in state1.value])
-
-                return value2 @ own_value
+                return value2 @ state1.asArray()
 
             # Case 1.4: value2 is a MatrixValue and this space is only consisting of scalar values
             if isinstance(value2, MatrixValue) and value2.shape == (len(self.dimensions), len(self.dimensions)) and all(
@@ -1166,6 +1956,15 @@ class Space:
     def __getitem__(self, item):
         return self.getDimension(item)
 
+    def __setattr__(self, name, value):
+        if name == 'mappings' and isinstance(value, list) and not isinstance(value, MappingList):
+            value = MappingList(value)
+        # Changing the mappings or the parent of an initialized space changes how states are mapped
+        initialized = '_map_cache' in self.__dict__
+        super().__setattr__(name, value)
+        if initialized and name in ('mappings', 'parent'):
+            invalidateMappingCaches()
+
     def __repr__(self):
         out_str = '['
         for dim in self.dimensions:
@@ -1196,48 +1995,262 @@ class SpaceMapping:
 
     # ------------------------------------------------------------------------------------------------------------------
     def map(self, state, space_to: Space = None):
+        if not (state.space == self.space_from or isinstance(state.space, self.space_from)):
+            raise Exception("State cannot be mapped with this mapping")
+        return self.map_into(state, self._getTargetSpace(space_to).getState())
 
-        if state.space == self.space_from or isinstance(state.space, self.space_from):
-            # Case 1: the target state is given as instance in this mapping
-            if isinstance(self.space_to, Space):
-                target_space = self.space_to
-            # Case 2: the target state is given as a class and is given as argument here:
-            elif isinstance(self.space_to, type) and isinstance(space_to, self.space_to):
-                target_space = space_to
-            else:
-                raise Exception()
+    # ------------------------------------------------------------------------------------------------------------------
+    def map_into(self, state, out: 'State') -> 'State':
+        """
+        Maps the state into the existing State out of the target space instead of creating a new State. Returns out
+        """
+        if not (state.space == self.space_from or isinstance(state.space, self.space_from)):
+            raise Exception("State cannot be mapped with this mapping")
+        if not _matchesSpace(self.space_to, out.space):
+            raise Exception("Output state is not in the target space of this mapping")
+
+        mapped_state = self.mapping(state)
+
+        if isinstance(mapped_state, dict):
+            # Values that are not given by the mapping are reset like in a new State
+            for val in out.value:
+                if val.name not in mapped_state:
+                    val.zero()
+            for key, item in mapped_state.items():
+                out[key].set(item)
+        else:
+            out.set(mapped_state)
 
-            new_state = target_space.getState()
-            mapped_state = self.mapping(state)
+        # Check for relative state:
+        if out.space == state.space.parent:
+            out.set(state.space.origin + out)
+
+        return out
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _getTargetSpace(self, space_to: Space = None) -> Space:
+        # Case 1: the target state is given as instance in this mapping
+        if isinstance(self.space_to, Space):
+            return self.space_to
+        # Case 2: the target state is given as a class and is given as argument here:
+        elif isinstance(self.space_to, type) and isinstance(space_to, self.space_to):
+            return space_to
+        else:
+            raise Exception()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def mapBatch(self, batch: 'StateBatch', space_to: Space = None) -> 'StateBatch':
+        """
+        Maps a whole batch of states. Mappings that implement _mapBatch are evaluated vectorized, all others fall
+        back to mapping the states one by one
+        """
+        if not (batch.space == self.space_from or isinstance(batch.space, self.space_from)):
+            raise Exception("Batch cannot be mapped with this mapping")
 
-            if isinstance(mapped_state, dict):
-                for key, item in mapped_state.items():
-                    new_state[key].set(item)
+        target_space = self._getTargetSpace(space_to)
+
+        new_batch = StateBatch(space=target_space, n=len(batch))
+
+        if hasattr(self, '_mapBatch'):
+            mapped_batch = self._mapBatch(batch)
+            if isinstance(mapped_batch, dict):
+                for key, item in mapped_batch.items():
+                    new_batch[key] = item
             else:
-                new_state.set(mapped_state)
+                new_batch.value[:] = mapped_batch
+            target_space.project(new_batch.value)
+        else:
+            for i, state in enumerate(batch):
+                mapped_state = self.map(state, target_space)
+                new_batch.value[i] = mapped_state.asArray()
+            return new_batch
 
-            # Check for relative state:
-            if target_space == state.space.parent:
-                new_state = state.space.origin + new_state
+        # Check for relative state:
+        if target_space == batch.space.parent:
+            new_batch = batch.space.origin + new_batch
 
-            return new_state
+        return new_batch
+
+
+# ======================================================================================================================
+class MappingChain:
+    """
+    Mapping over several SpaceMappings, e.g. TWIPR state space -> Space3D_TWIPR -> Space3D. The chain is found by a
+    shortest path search over the mappings the spaces know and is compiled into one function, which runs all hops
+    on preallocated array-backed states instead of creating intermediate States
+    """
+    space_from: Space
+    space_to: Space
+    mappings: list[SpaceMapping]
+    spaces: list[Space]  # All spaces along the chain, starting with space_from and ending with space_to
+    function: callable  # Compiled chain: function(state) -> flat array in the layout of space_to
+
+    def __init__(self, mappings: list[SpaceMapping], spaces: list[Space]):
+        assert (len(mappings) == len(spaces) - 1)
+        self.mappings = mappings
+        self.spaces = spaces
+        self.space_from = spaces[0]
+        self.space_to = spaces[-1]
+        self.function = self._compile()
+        self._owner = threading.get_ident()
+        self._local = threading.local()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def find(space_from: Space, space_to: Space, max_hops: int = 4) -> 'MappingChain':
+        """
+        Breadth-first search for the shortest chain of mappings from space_from to space_to. Spaces that are only
+        known as class in a mapping are instantiated. Returns None if there is no chain with at most max_hops hops
+        """
+        queue = collections.deque([(space_from, [], [space_from])])
+        # Spaces named as instance are visited by id, spaces named as class by their class
+        visited = {id(space_from), type(space_from)}
+
+        while len(queue) > 0:
+            space, mappings, spaces = queue.popleft()
+            if len(mappings) >= max_hops:
+                continue
+
+            # Mappings known by this space, and mappings known by the target space that start in this space
+            candidates = [mapping for mapping in space.mappings if _matchesSpace(mapping.space_from, space)]
+            candidates += [mapping for mapping in space_to.mappings if
+                           _matchesSpace(mapping.space_from, space) and _matchesSpace(mapping.space_to, space_to)]
+
+            for mapping in candidates:
+                if _matchesSpace(mapping.space_to, space_to):
+                    return MappingChain(mappings=mappings + [mapping], spaces=spaces + [space_to])
+
+                key = id(mapping.space_to) if isinstance(mapping.space_to, Space) else mapping.space_to
+                if key in visited:
+                    continue
+                visited.add(key)
+
+                if isinstance(mapping.space_to, Space):
+                    next_space = mapping.space_to
+                else:
+                    try:
+                        next_space = mapping.space_to()
+                    except TypeError:
+                        continue
+
+                queue.append((next_space, mappings + [mapping], spaces + [next_space]))
+
+        return None
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def map(self, state: 'State', space_to: Space = None) -> 'State':
+        return self.map_into(state, self.space_to.getState())
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def map_into(self, state: 'State', out: 'State') -> 'State':
+        output = self._getFunction()(state)
+        # The output of the last hop is already projected
+        if out.buffer is not None:
+            out.buffer[:] = output
+            out._version = next(_state_versions)
         else:
-            raise Exception("State cannot be mapped with this mapping")
+            out.setArray(output)
+        return out
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def mapBatch(self, batch: 'StateBatch', space_to: Space = None) -> 'StateBatch':
+        for mapping, space in zip(self.mappings, self.spaces[1:]):
+            batch = mapping.mapBatch(batch, space)
+        return batch
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _getFunction(self):
+        # The preallocated states of the compiled function are not reentrant. Other threads than the one that built
+        # the chain, e.g. the workers of parallel actions, compile their own copy
+        if threading.get_ident() == self._owner:
+            return self.function
+        function = getattr(self._local, 'function', None)
+        if function is None:
+            function = self._local.function = self._compile()
+        return function
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _compile(self):
+        # One array-backed state per hop target. They are reset to the zero state of their space before each hop
+        states = [space.getState(buffer=np.zeros(space.size)) for space in self.spaces[1:]]
+        zero_values = [space.getState().asArray().copy() for space in self.spaces[1:]]
+
+        hops = []
+        for i, mapping in enumerate(self.mappings):
+            space_in = self.spaces[i]
+            origin = space_in.origin if space_in.parent is not None and space_in.parent == self.spaces[i + 1] else None
+            hops.append((mapping.mapping, states[i], states[i].buffer, zero_values[i], origin))
+
+        output = states[-1].buffer
+
+        def function(state: 'State') -> np.ndarray:
+            for mapping_function, state_out, buffer_out, zero, origin in hops:
+                buffer_out[:] = zero
+                mapped_state = mapping_function(state)
+                if isinstance(mapped_state, dict):
+                    for key, item in mapped_state.items():
+                        state_out[key].set(item)
+                else:
+                    state_out.set(mapped_state)
+                if origin is not None:
+                    state_out.set(origin + state_out)
+                state = state_out
+            return output
+
+        return function
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __call__(self, state: 'State') -> np.ndarray:
+        return self._getFunction()(state)
+
+    def __repr__(self):
+        return ' -> '.join(type(space).__name__ for space in self.spaces)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+def _matchesSpace(space_definition: (Space, type), space: (Space, type)) -> bool:
+    # Space definitions in mappings are either instances or classes
+    if isinstance(space_definition, Space):
+        return space_definition is space
+    if isinstance(space, type):
+        return issubclass(space, space_definition)
+    return isinstance(space, space_definition)
 
 
 # ======================================================================================================================
 class State:
+    __slots__ = ('space', 'value', 'buffer', '_version')
+
     space: Space
     value: list[StateValue]
+    buffer: np.ndarray  # Flat float64 storage of an array-backed State. None otherwise
 
-    def __init__(self, space, value=None):
+    def __init__(self, space, value=None, buffer: np.ndarray = None):
         self.space = space
-
-        # Prepare the value
+        self._version = 0  # Version of the last write to the buffer that did not go through the values
+
+        # An external buffer is wrapped as it is, an internal one is initialized with the zero state of the space
+        external_data = None
+        if buffer is not None:
+            assert (buffer.shape == (self.space.size,))
+            external_data = buffer.copy()
+        elif self.space.array_backed:
+            buffer = np.zeros(self.space.size)
+        self.buffer = buffer
+
+        # Prepare the value. For an array-backed State each value is a view into its slice of the buffer
         self.value = []
 
-        for i, dim in enumerate(self.space.dimensions):
-            self.value.append(dim.getValue())
+        if self.buffer is None:
+            for dim in self.space.dimensions:
+                self.value.append(dim.getValue())
+        else:
+            for dim, dim_slice in zip(self.space.dimensions, self.space.dimension_slices.values()):
+                self.value.append(dim.getValue(buffer=self.buffer[dim_slice]))
+
+        if external_data is not None:
+            self.buffer[:] = external_data
+            self._version = next(_state_versions)
 
         if value is not None:
             self.set(value)
@@ -1245,20 +2258,27 @@ class State:
     # ------------------------------------------------------------------------------------------------------------------
     def set(self, value, index: (int, str) = None):
         if index is None:
-            if len(self.space.dimensions) > 1:
+            if value is self:
+                # Setting a state to itself does not change it and keeps its version
+                return
+            if isinstance(value, State):
+                # Values of the same space are already projected and can be copied in one go
+                if self.buffer is not None and value.buffer is not None and value.space is self.space:
+                    self.buffer[:] = value.buffer
+                    self._version = next(_state_versions)
+                    return
+                for i in range(0, len(self.space.dimensions)):
+                    self.value[i].set(value.value[i])
+            elif len(self.space.dimensions) > 1:
                 if isinstance(value, list):
                     for i in range(0, len(self.space.dimensions)):
                         self.value[i].set(value[i])
-                elif isinstance(value, State):
-                    for i in range(0, len(self.space.dimensions)):
-                        self.value[i].set(value.value[i])
             else:
                 self.value[0].set(value)
         elif isinstance(index, int):
             self.value[index].set(value)
         elif isinstance(index, str):
-            val = next((val for val in self.value if val.name == index), None)
-            val.set(value)
+            self.value[self.space.dimension_index[index]].set(value)
 
     # ------------------------------------------------------------------------------------------------------------------
     def get(self, index: (int, str) = None):
@@ -1267,8 +2287,147 @@ class State:
         elif isinstance(index, int):
             return self.value[index]
         elif isinstance(index, str):
-            val = next((val for val in self.value if val.name == index), None)
-            return val
+            dim_index = self.space.dimension_index.get(index)
+            if dim_index is None:
+                return None
+            return self.value[dim_index]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @property
+    def version(self) -> int:
+        """
+        Changes whenever the state is written through the State or its values, and is never reused for different
+        values. Derived data, e.g. a mapped State, stays valid as long as the version of its source is the same.
+        Writes into arrays that were obtained from the state, e.g. asArray(), value.value or an accessor, are not
+        tracked
+        """
+        version = self._version
+        for val in self.value:
+            if val._version > version:
+                version = val._version
+        return version
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def asArray(self) -> np.ndarray:
+        """
+        Returns the values of the state as flat array in the layout of the space. For an array-backed state this is
+        the buffer itself, otherwise a new array. Scalar values that are None are NaN in the array
+        """
+        if self.buffer is not None:
+            return self.buffer
+        if self.space.size == len(self.value):
+            # Only scalar values
+            return np.array([val.value for val in self.value], dtype=float)
+        return np.concatenate([np.ravel(val.value) for val in self.value]).astype(float)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def setArray(self, values: np.ndarray):
+        """
+        Sets the state from a flat array in the layout of the space. The values are projected like in set() and NaN
+        scalars are set to None, like in asArray()
+        """
+        if self.space._trusted:
+            self.setTrusted(values)
+            return
+
+        if self.buffer is not None:
+            self.buffer[:] = values
+            self.space.project(self.buffer[np.newaxis, :])
+            self._version = next(_state_versions)
+            return
+
+        for val, dim_slice, shape in zip(self.value, self.space.dimension_slices.values(),
+                                         self.space.dimension_shapes.values()):
+            if shape is None:
+                value = values[dim_slice.start]
+                val.set(None if value != value else value)
+            else:
+                val.set(np.reshape(values[dim_slice], shape))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def setTrusted(self, values: ('State', np.ndarray)):
+        """
+        Sets the state from a flat array in the layout of the space without conversion, limits, wrapping and
+        discretization. The producer of the values has to guarantee that they are valid. With
+        VALIDATE_TRUSTED_WRITES, the state is checked afterwards and an exception is raised for invalid values
+        """
+        if isinstance(values, State):
+            values = values.asArray()
+
+        if self.buffer is not None:
+            self.buffer[:] = values
+            self._version = next(_state_versions)
+        else:
+            for val, dim_slice in zip(self.value, self.space.dimension_slices.values()):
+                val._setTrusted(values[dim_slice])
+
+        if VALIDATE_TRUSTED_WRITES:
+            self.validate()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def validate(self):
+        """
+        Raises an exception if the state is not valid in its space, i.e. if projecting it would change any value
+        """
+        values = np.array(self.asArray(), dtype=float)[np.newaxis, :]
+        projected = self.space.project(values.copy())
+        if not np.allclose(values, projected, equal_nan=True):
+            invalid = [name for name, dim_slice in self.space.dimension_slices.items() if
+                       not np.allclose(values[0, dim_slice], projected[0, dim_slice], equal_nan=True)]
+            raise Exception(f"Invalid state in space {type(self.space).__name__}: {invalid}")
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def attach(self, buffer: np.ndarray):
+        """
+        Moves the state into an external flat buffer, e.g. a row of a larger array. The current values are copied
+        into the buffer and all values become views into it
+        """
+        assert (buffer.shape == (self.space.size,))
+        buffer[:] = self.asArray()
+        self.buffer = buffer
+        for val, dim_slice in zip(self.value, self.space.dimension_slices.values()):
+            val._attach(buffer[dim_slice])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def copy(self) -> 'State':
+        """
+        Copies the state. An array-backed state is copied with one copy of its buffer
+        """
+        return self._copy()
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        # The space is shared, all values are independent copies
+        new_state = State.__new__(State)
+        memo[id(self)] = new_state
+        new_state.space = self.space
+        new_state._version = self._version
+        new_state.buffer = self.buffer.copy() if self.buffer is not None else None
+        new_state.value = [copy.deepcopy(val, memo) for val in self.value]
+        if new_state.buffer is not None:
+            for val, dim_slice in zip(new_state.value, self.space.dimension_slices.values()):
+                val._attach(new_state.buffer[dim_slice])
+        return new_state
+
+    def _copy(self, share: bool = False) -> 'State':
+        # With share, the vector and matrix values are copy-on-write copies, see StateValue._copy()
+        new_state = State.__new__(State)
+        new_state.space = self.space
+        new_state._version = self._version
+        if self.buffer is None:
+            new_state.buffer = None
+            new_state.value = [val._copy(share) for val in self.value]
+            return new_state
+
+        new_state.buffer = self.buffer.copy()
+        new_state.value = []
+        for val, dim_slice in zip(self.value, self.space.dimension_slices.values()):
+            new_value = StateValue._copy(val)
+            new_value._attach(new_state.buffer[dim_slice])
+            new_state.value.append(new_value)
+        return new_state
 
     # ------------------------------------------------------------------------------------------------------------------
     def map(self, space: Space):
@@ -1281,6 +2440,15 @@ class State:
             out[val.name] = val.serialize()
         return out
 
+    # ------------------------------------------------------------------------------------------------------------------
+    def encode(self) -> bytes:
+        """
+        Compact binary encoding of the state: the flat array in the layout of the space. The layout is described by
+        space.getSchema() and the state is decoded by space.decode() or decodeToDict(). Scalar values that are None
+        are encoded as NaN and decoded as None again
+        """
+        return self.asArray().astype(ENCODING_DTYPE, copy=False).tobytes()
+
     # ------------------------------------------------------------------------------------------------------------------
     def __add__(self, other):
         return self.space.add(self, other)
@@ -1329,20 +2497,39 @@ class State:
     def __setitem__(self, key, value):
         self.set(value, key)
 
+    # ------------------------------------------------------------------------------------------------------------------
+    def __array__(self, dtype=None, copy=None):
+        # Flat values of the state. For an array-backed state this is the buffer itself and nothing is copied
+        array = self.asArray()
+        if dtype is not None and array.dtype != dtype:
+            return array.astype(dtype)
+        if copy:
+            return array.copy()
+        return array
+
     # ------------------------------------------------------------------------------------------------------------------
     def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
-        if ufunc.__name__ == "matmul":
-            return self.__mul__(inputs[0])
-        elif ufunc.__name__ == 'subtract':
-            raise Exception("Not implemented yet!")
-            # raise Exception("Not implemented yet!")
-        elif ufunc.__name__ == 'multiply':
-            raise Exception("Not implemented yet!")
-            # return self.mul(inputs[0])
-        elif ufunc.__name__ == 'add':
-            raise Exception("Not implemented yet!")
-        else:
-            raise Exception("Not implemented yet!")
+        """
+        add, subtract, multiply and matmul with NumPy operands work on the flat values of the states, e.g. K @ state
+        in a controller. The result is a plain array, or the given out State, which has to be array-backed
+        """
+        if method != '__call__' or ufunc.__name__ not in ('add', 'subtract', 'multiply', 'matmul'):
+            return NotImplemented
+
+        arrays = [item.asArray() if isinstance(item, State) else item for item in inputs]
+
+        out = kwargs.get('out')
+        if out is not None and isinstance(out[0], State):
+            out_state = out[0]
+            if out_state.buffer is None:
+                raise Exception("The output state of a ufunc has to be array-backed")
+            kwargs['out'] = (out_state.buffer,)
+            ufunc(*arrays, **kwargs)
+            out_state.space.project(out_state.buffer[np.newaxis, :])
+            out_state._version = next(_state_versions)
+            return out_state
+
+        return ufunc(*arrays, **kwargs)
 
     # ------------------------------------------------------------------------------------------------------------------
     def __repr__(self):
@@ -1353,37 +2540,211 @@ class State:
         return out
 
 
+# ======================================================================================================================
+class StateAccessor:
+    """
+    Base of the accessor types generated by compileSpace. An accessor wraps a flat float64 array in the layout of a
+    space and has one property per dimension: scalars are read and written as numbers, vectors and matrices as views
+    into the array. Values are not projected, i.e. limits, wrapping and discretization are not applied
+    """
+    __slots__ = ('array',)
+
+    size: int
+    dimension_names: tuple
+
+    def __init__(self, array: np.ndarray = None):
+        if array is None:
+            array = np.zeros(self.size)
+        assert (array.shape == (self.size,))
+        self.array = array
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def from_array(cls, array: np.ndarray) -> 'StateAccessor':
+        # Wraps the array without copying it
+        return cls(array)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def to_array(self) -> np.ndarray:
+        return self.array
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)}' for name in self.dimension_names)})"
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+def compileSpace(space: Space) -> type:
+    """
+    Generates the accessor type of a space, see StateAccessor. The type is compiled once per layout, i.e. once per
+    space class for spaces that define their dimensions on the class
+    """
+    layout = space.layout
+    if layout.accessor_type is not None:
+        return layout.accessor_type
+
+    namespace = {'__slots__': (), 'size': layout.size, 'dimension_names': tuple(layout.index.keys())}
+    for name, dim_slice in layout.slices.items():
+        if not name.isidentifier() or hasattr(StateAccessor, name):
+            raise Exception(f"Dimension name \"{name}\" cannot be used as accessor property")
+        namespace[name] = _accessorProperty(dim_slice, layout.shapes[name])
+
+    layout.accessor_type = type(f"{type(space).__name__}Accessor", (StateAccessor,), namespace)
+    return layout.accessor_type
+
+
+def _accessorProperty(dim_slice: slice, shape: tuple) -> property:
+    if shape is None:
+        index = dim_slice.start
+
+        def getter(self):
+            # A Python float is much faster than a numpy scalar in scalar arithmetic
+            return self.array.item(index)
+
+        def setter(self, value):
+            self.array[index] = value
+    else:
+        def getter(self):
+            return self.array[dim_slice].reshape(shape)
+
+        def setter(self, value):
+            self.array[dim_slice] = np.ravel(value)
+
+    return property(getter, setter)
+
+
+# ======================================================================================================================
+class StateBatch:
+    """
+    N states of one space, stored as array of shape (N, space.size) in the flat layout of the space. Single states
+    and dimensions can be accessed as views into the array
+    """
+    space: Space
+    value: np.ndarray
+
+    def __init__(self, space: Space, value=None, n: int = None):
+        self.space = space
+
+        if isinstance(value, np.ndarray):
+            assert (value.ndim == 2 and value.shape[1] == self.space.size)
+            self.value = np.asarray(value, dtype=float)
+            self.space.project(self.value)
+        elif isinstance(value, list):
+            self.value = np.asarray([self.space.map(state).asArray() for state in value], dtype=float)
+        else:
+            assert (n is not None)
+            self.value = np.tile(self.space.getState().asArray(), (n, 1))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def get(self, index: (int, str) = None):
+        if index is None:
+            return self.value
+        elif isinstance(index, int):
+            return self.space.getState(buffer=self.value[index])
+        elif isinstance(index, str):
+            dim_slice = self.space.dimension_slices[index]
+            shape = self.space.dimension_shapes[index]
+            if shape is None:
+                return self.value[:, dim_slice.start]
+            return self.value[:, dim_slice].reshape((len(self),) + tuple(shape))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def set(self, value, index: (int, str) = None):
+        if index is None:
+            self.value[:] = value
+            self.space.project(self.value)
+        elif isinstance(index, int):
+            self.value[index] = self.space.map(value).asArray()
+        elif isinstance(index, str):
+            view = self.get(index)
+            view[...] = value
+            projection = self.space.getDimension(index).projection
+            if projection.active:
+                projection.apply(self.value[:, self.space.dimension_slices[index]])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def map(self, space: Space) -> 'StateBatch':
+        return space.map(value=self)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def getStates(self) -> list[State]:
+        return [self.space.getState(value=state) for state in self]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __len__(self):
+        return self.value.shape[0]
+
+    def __iter__(self):
+        for i in range(0, len(self)):
+            yield self.get(i)
+
+    def __getitem__(self, item):
+        return self.get(item)
+
+    def __setitem__(self, key, value):
+        self.set(value, key)
+
+    def __add__(self, other):
+        return self.space.add(self, other)
+
+    def __radd__(self, other):
+        return self.space.add(other, self)
+
+    def __iadd__(self, other):
+        return self.space.iadd(self, other)
+
+    def __sub__(self, other):
+        return self.space.sub(self, other)
+
+    def __rsub__(self, other):
+        return self.space.sub(other, self)
+
+    def __isub__(self, other):
+        return self.space.isub(self, other)
+
+    def __repr__(self):
+        return f"StateBatch(space={self.space}, n={len(self)})"
+
+
 # ======================================================================================================================
 # SPECIAL SPACES
 
 class PositionVector3D(VectorValue):
+    __slots__ = ()
+
     names = ['x', 'y', 'z']
     shape = (3,)
     name = 'pos'
 
     def __init__(self, name: str = None, value: (list, np.ndarray) = None, limits: list = None,
-                 discretization: list = None, wrapping: (list, bool) = True):
-        super().__init__(name=name, value=value, limits=limits, discretization=discretization, wrapping=wrapping)
+                 discretization: list = None, wrapping: (list, bool) = True, buffer: np.ndarray = None):
+        super().__init__(name=name, value=value, limits=limits, discretization=discretization, wrapping=wrapping,
+                         buffer=buffer)
 
 
 # ======================================================================================================================
 class PositionVector2D(VectorValue):
+    __slots__ = ()
+
     names = ['x', 'y']
     shape = (2,)
     name = 'pos'
 
     def __init__(self, name: str = None, value: (list, np.ndarray) = None, limits: list = None,
-                 discretization: list = None, wrapping: (list, bool) = True):
-        super().__init__(name=name, value=value, limits=limits, discretization=discretization, wrapping=wrapping)
+                 discretization: list = None, wrapping: (list, bool) = True, buffer: np.ndarray = None):
+        super().__init__(name=name, value=value, limits=limits, discretization=discretization, wrapping=wrapping,
+                         buffer=buffer)
 
 
 # ======================================================================================================================
 class OrientationMatrix3D(MatrixValue):
+    __slots__ = ()
+
     shape = (3, 3)
     name = 'ori'
 
-    def __init__(self, name: str = None, value: (list, np.ndarray) = None):
-        super().__init__(name, value)
+    def __init__(self, name: str = None, value: (list, np.ndarray) = None, buffer: np.ndarray = None):
+        super().__init__(name, value, buffer=buffer)
 
     def getHeading(self):
         return orientation_utils.psiFromRotMat(self.value)
@@ -1403,6 +2764,53 @@ class OrientationMatrix3D(MatrixValue):
         ...
 
 
+# ======================================================================================================================
+class OrientationQuaternion(VectorValue):
+    """
+    Orientation as unit quaternion [w, x, y, z]. Alternative to OrientationMatrix3D that composes with 16
+    multiplications and maps to headings and TWIPR angles without a rotation matrix in between
+    """
+    __slots__ = ()
+
+    names = ['w', 'x', 'y', 'z']
+    shape = (4,)
+    name = 'ori'
+
+    def __init__(self, name: str = None, value: (list, np.ndarray) = None, buffer: np.ndarray = None):
+        super().__init__(name=name, value=value, buffer=buffer)
+
+    def getHeading(self):
+        return orientation_utils.psiFromQuat(self.value)
+
+    def getRotMat(self):
+        return qmt.quatToRotMat(self.value)
+
+    def setFromRotMat(self, rotmat):
+        self.set(qmt.quatFromRotMat(rotmat))
+
+    def setFromEuler(self, angles, convention):
+        self.set(qmt.quatFromEulerAngles(angles=np.asarray(angles), axes=convention, intrinsic=True))
+
+    def random(self):
+        self.set(qmt.randomQuat())
+
+    def normalize(self):
+        self.set(orientation_utils.quatNormalize(self.value))
+
+    def compose(self, other):
+        if isinstance(other, StateValue):
+            other = other.value
+        new_value = self._copy(share=True)
+        new_value.set(orientation_utils.quatMultiply(self.value, other))
+        return new_value
+
+    def _zero(self):
+        return np.array([1.0, 0.0, 0.0, 0.0])
+
+    def __matmul__(self, other):
+        return self.compose(other)
+
+
 # ======================================================================================================================
 class Space3D(Space):
     dimensions = [VectorDimension(name='pos', base_type=PositionVector3D),
@@ -1414,6 +2822,17 @@ class Space3D(Space):
         new_state['ori'] = state1['ori'] @ state2['ori']
         return new_state
 
+    def _addBatch(self, values1, values2):
+        pos = self.dimension_slices['pos']
+        ori = self.dimension_slices['ori']
+        ori1 = values1[:, ori].reshape(-1, 3, 3)
+        ori2 = values2[:, ori].reshape(-1, 3, 3)
+
+        out = np.empty((max(len(values1), len(values2)), self.size))
+        out[:, pos] = values1[:, pos] + np.matmul(ori1, values2[:, pos, np.newaxis])[:, :, 0]
+        out[:, ori] = np.matmul(ori1, ori2).reshape(-1, 9)
+        return out
+
     def _mul(self, state1, state2, value1, value2, new_state):
         raise Exception("Multiplication is not allowed in this space")
 
@@ -1424,6 +2843,32 @@ class Space3D(Space):
         raise Exception("Not yet implemented")
 
 
+# ======================================================================================================================
+class Space3DQuat(Space):
+    dimensions = [VectorDimension(name='pos', base_type=PositionVector3D),
+                  VectorDimension(name='ori', base_type=OrientationQuaternion)]
+
+    def _add(self, state1, state2, new_state):
+        add_value = qmt.rotate(state1['ori'].value, state2['pos'].value)
+        new_state['pos'] = state1['pos'] + add_value
+        # Renormalized to keep repeated compositions from drifting away from unit length
+        new_state['ori'] = orientation_utils.quatNormalize(
+            orientation_utils.quatMultiply(state1['ori'].value, state2['ori'].value))
+        return new_state
+
+    def _addBatch(self, values1, values2):
+        pos = self.dimension_slices['pos']
+        ori = self.dimension_slices['ori']
+
+        out = np.empty((max(len(values1), len(values2)), self.size))
+        out[:, pos] = values1[:, pos] + qmt.rotate(values1[:, ori], values2[:, pos])
+        out[:, ori] = orientation_utils.quatNormalize(orientation_utils.quatMultiply(values1[:, ori], values2[:, ori]))
+        return out
+
+    def _mul(self, state1, state2, value1, value2, new_state):
+        raise Exception("Multiplication is not allowed in this space")
+
+
 # ======================================================================================================================
 class Space2D(Space):
     dimensions = [VectorDimension(name='pos', base_type=PositionVector2D),
@@ -1435,6 +2880,20 @@ class Space2D(Space):
         new_state['psi'] = state1['psi'] + state2['psi']
         return new_state
 
+    def _addBatch(self, values1, values2):
+        pos = self.dimension_slices['pos']
+        psi = self.dimension_slices['psi'].start
+        c = np.cos(values1[:, psi])
+        s = np.sin(values1[:, psi])
+        x2 = values2[:, pos.start]
+        y2 = values2[:, pos.start + 1]
+
+        out = np.empty((max(len(values1), len(values2)), self.size))
+        out[:, pos.start] = values1[:, pos.start] + c * x2 - s * y2
+        out[:, pos.start + 1] = values1[:, pos.start + 1] + s * x2 + c * y2
+        out[:, psi] = values1[:, psi] + values2[:, psi]
+        return out
+
     def _mul(self, state1, state2, value1, value2, new_state):
         raise Exception("Multiplication is not allowed in this space")
 
@@ -1461,6 +2920,13 @@ class Mapping_Coord1Dto2D(SpaceMapping):
         }
         return out
 
+    def _mapBatch(self, batch):
+        out = {
+            'x': batch['x'],
+            'y': 0
+        }
+        return out
+
 
 # ======================================================================================================================
 class Mapping2D2D(SpaceMapping):
@@ -1480,6 +2946,9 @@ class Mapping2D2D(SpaceMapping):
         }
         return out
 
+    def _mapBatch(self, batch_2d):
+        return batch_2d.value
+
 
 class Mapping3D3D(SpaceMapping):
     space_to = Space3D
@@ -1495,6 +2964,9 @@ class Mapping3D3D(SpaceMapping):
         }
         return out
 
+    def _mapBatch(self, batch_3d):
+        return batch_3d.value
+
 
 class Mapping2D3D(SpaceMapping):
     offset_z = 0
@@ -1514,6 +2986,14 @@ class Mapping2D3D(SpaceMapping):
         }
         return out
 
+    def _mapBatch(self, batch_2d):
+        pos = batch_2d['pos']
+        out = {
+            'pos': np.column_stack((pos[:, 0], pos[:, 1], np.full(len(batch_2d), self.offset_z))),
+            'ori': orientation_utils.rotmatFromPsi(batch_2d['psi'])
+        }
+        return out
+
 
 class Mapping3D2D(SpaceMapping):
     offset_z = 0
@@ -1533,7 +3013,114 @@ class Mapping3D2D(SpaceMapping):
         }
         return out
 
+    def _mapBatch(self, batch_3d):
+        out = {
+            'pos': batch_3d['pos'][:, 0:2],
+            'psi': orientation_utils.psiFromRotMat(batch_3d['ori'])
+        }
+        return out
+
+
+class Mapping3DQuat3DQuat(SpaceMapping):
+    space_to = Space3DQuat
+    space_from = Space3DQuat
+
+    def _map(self, state_3d):
+        out = {
+            'pos': state_3d['pos'],
+            'ori': state_3d['ori']
+        }
+        return out
+
+    def _mapBatch(self, batch_3d):
+        return batch_3d.value
+
+
+class Mapping3DQuat3D(SpaceMapping):
+    space_to = Space3D
+    space_from = Space3DQuat
+
+    def _map(self, state_3d):
+        out = {
+            'pos': state_3d['pos'],
+            'ori': qmt.quatToRotMat(state_3d['ori'].value)
+        }
+        return out
+
+    def _mapBatch(self, batch_3d):
+        out = {
+            'pos': batch_3d['pos'],
+            'ori': qmt.quatToRotMat(batch_3d['ori'])
+        }
+        return out
+
+
+class Mapping3D3DQuat(SpaceMapping):
+    space_to = Space3DQuat
+    space_from = Space3D
+
+    def _map(self, state_3d):
+        out = {
+            'pos': state_3d['pos'],
+            'ori': qmt.quatFromRotMat(state_3d['ori'].value)
+        }
+        return out
+
+    def _mapBatch(self, batch_3d):
+        out = {
+            'pos': batch_3d['pos'],
+            'ori': qmt.quatFromRotMat(batch_3d['ori'])
+        }
+        return out
+
+
+class Mapping3DQuat2D(SpaceMapping):
+    space_to = Space2D
+    space_from = Space3DQuat
+
+    def _map(self, state_3d):
+        out = {
+            'pos': [state_3d['pos']['x'], state_3d['pos']['y']],
+            'psi': orientation_utils.psiFromQuat(state_3d['ori'].value)
+        }
+        return out
+
+    def _mapBatch(self, batch_3d):
+        out = {
+            'pos': batch_3d['pos'][:, 0:2],
+            'psi': orientation_utils.psiFromQuat(batch_3d['ori'])
+        }
+        return out
+
+
+class Mapping2D3DQuat(SpaceMapping):
+    offset_z = 0
+    space_to = Space3DQuat
+    space_from = Space2D
+
+    def __init__(self, offset_z=None):
+        super().__init__()
+
+        if offset_z is not None:
+            self.offset_z = offset_z
+
+    def _map(self, state_2d):
+        out = {
+            'pos': [state_2d['pos']['x'], state_2d['pos']['y'], self.offset_z],
+            'ori': orientation_utils.quatFromPsi(state_2d['psi'].value)
+        }
+        return out
+
+    def _mapBatch(self, batch_2d):
+        pos = batch_2d['pos']
+        out = {
+            'pos': np.column_stack((pos[:, 0], pos[:, 1], np.full(len(batch_2d), self.offset_z))),
+            'ori': orientation_utils.quatFromPsi(batch_2d['psi'])
+        }
+        return out
+
 
-Space2D.mappings = [Mapping2D3D(), Mapping2D2D()]
-Space3D.mappings = [Mapping3D2D(), Mapping3D3D()]
+Space2D.mappings = [Mapping2D3D(), Mapping2D2D(), Mapping2D3DQuat()]
+Space3D.mappings = [Mapping3D2D(), Mapping3D3D(), Mapping3D3DQuat()]
+Space3DQuat.mappings = [Mapping3DQuat2D(), Mapping3DQuat3D(), Mapping3DQuat3DQuat()]
 CoordSpace1D.mappings = [Mapping_Coord1Dto2D()]
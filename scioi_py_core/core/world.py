@@ -1,6 +1,8 @@
+import collections
 import dataclasses
 import logging
 import re
+import struct
 from abc import ABC, abstractmethod
 from typing import Union
 
@@ -79,6 +81,8 @@ class WorldObject(scheduling.ScheduledObject):
 
         self.id = f"{type(self).__name__}_{id(self)}"
         self._configuration = None
+        self._configuration_global = None  # Reused output State of _getConfigurationGlobal()
+        self._configuration_global_key = None  # Versions the global configuration was computed from
 
         super().__init__()
 
@@ -108,6 +112,9 @@ class WorldObject(scheduling.ScheduledObject):
         if self.space is not None:
             self._configuration = self.space.getState()
 
+        if self.world is not None and hasattr(self.world, 'registry'):
+            self.world.registry.add(self)
+
         self.collision = CollisionData()
 
         self.visualization = WorldObjectVisualization()
@@ -131,7 +138,11 @@ class WorldObject(scheduling.ScheduledObject):
 
     @property
     def configuration_global(self):
-        return self.space_global.map(self.configuration)
+        # New State on every access, see getConfiguration() to write it into a reused State instead
+        configuration = self._getConfigurationGlobal()
+        if configuration is None:
+            return None
+        return configuration.copy()
 
     @configuration_global.setter
     def configuration_global(self, value):
@@ -195,12 +206,23 @@ class WorldObject(scheduling.ScheduledObject):
         self.setConfiguration(dimension='ori', value=value)
 
     # ------------------------------------------------------------------------------------------------------------------
-    def getConfiguration(self, space='local'):
+    def getConfiguration(self, space='local', out: core_spaces.State = None):
+        """
+        Returns the configuration in the local or the global space. With out, the configuration is written into the
+        given State instead of a new one, e.g. to reuse one State per object in a loop over many ticks
+        """
         assert (space == 'local' or space == 'global' or space == self.space or space == self.space_global)
+        if out is None:
+            if space == 'local' or space == self.space:
+                return self.configuration
+            else:
+                return self.configuration_global
+
         if space == 'local' or space == self.space:
-            return self.configuration
+            configuration = self._getConfigurationLocal()
         else:
-            return self.configuration_global
+            configuration = self._getConfigurationGlobal()
+        return out.space.map_into(configuration, out)
 
     # ------------------------------------------------------------------------------------------------------------------
     def _onAdd_callback(self):
@@ -212,7 +234,7 @@ class WorldObject(scheduling.ScheduledObject):
             'object_type': self.object_type,
             'id': self.id,
             'name': self.name,
-            'configuration': self.configuration_global.serialize(),
+            'configuration': self._getConfigurationGlobal().serialize(),
             'class': self.__class__.__name__
         }
         return parameters
@@ -220,12 +242,47 @@ class WorldObject(scheduling.ScheduledObject):
     # ------------------------------------------------------------------------------------------------------------------
     def _getSample(self):
         sample = {'id': self.id,
-                  'configuration': self.configuration_global.serialize(),
+                  'configuration': self._getConfigurationGlobal().serialize(),
                   'parameters': self.getParameters()
                   }
         return sample
 
     # === PRIVATE METHODS ==============================================================================================
+    def _getConfigurationLocal(self):
+        # Configuration without a new State, for reading only. Dynamic objects return their reused mapped state
+        return self._configuration
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _getConfigurationGlobal(self):
+        # The returned State is reused for every call and is the configuration itself for objects whose registry row
+        # is their configuration, so it must only be read. It is only mapped again if the local configuration, the
+        # origin of the local space, the mappings or the State itself have changed
+        configuration = self._getConfigurationLocal()
+        if configuration is None or self.space is None:
+            return None
+
+        if self._configuration_global is None or self._configuration_global.space is not self.space_global:
+            self._configuration_global = self.space_global.getState()
+            self._configuration_global_key = None
+
+        # Objects in the global space whose registry row is their configuration are already global
+        if self._configuration_global is configuration:
+            return configuration
+
+        origin = self.space.origin
+        key = (configuration.version, origin.version if origin is not None else 0, core_spaces._mapping_version)
+        out = self._configuration_global
+        if self._configuration_global_key is not None and self._configuration_global_key == (key, out.version):
+            return out
+
+        if self.group is not None and self.group.local_space is not None and self.space is self.group.local_space:
+            self.group.mapToGlobal(self, out)
+        else:
+            self.space_global.map_into(configuration, out)
+        self._configuration_global_key = (key, out.version)
+        return out
+
+    # ------------------------------------------------------------------------------------------------------------------
     def _updatePhysics(self, config=None, *args, **kwargs):
         if config is None:
             config = self.configuration_global
@@ -242,12 +299,18 @@ class WorldObject(scheduling.ScheduledObject):
 # ======================================================================================================================
 class WorldObjectGroup(WorldObject):
     objects: dict[str, WorldObject]
-    local_space: core_spaces.Space
+    local_space: core_spaces.Space = None
     object_type = 'group'
 
+    _transform: np.ndarray  # Flat global configuration of the group, shape (1, size)
+    _transform_version: int  # Version of the configuration of the group that _transform was taken from
+
     def __init__(self, name: str = None, world: 'World' = None, objects: list = None,
                  local_space: core_spaces.Space = None,
                  *args, **kwargs):
+        self._transform = None
+        self._transform_version = None
+
         super().__init__(name=name, world=world, *args, **kwargs)
         assert (self.space == self.world.space)
 
@@ -292,10 +355,224 @@ class WorldObjectGroup(WorldObject):
 
             logging.info(f"Added Object \"{obj.name}\" {type(obj)} to the group {self.name}")
 
+    # ------------------------------------------------------------------------------------------------------------------
+    def getTransform(self) -> tuple[np.ndarray, int]:
+        """
+        Returns the flat global configuration of the group, which is the origin of the local space, together with the
+        version of the configuration it was taken from. It is only taken again if the group has moved
+        """
+        configuration = self.configuration
+        version = configuration.version
+        if version != self._transform_version:
+            self._transform = configuration.asArray().reshape(1, -1).copy()
+            self._transform_version = version
+        return self._transform, self._transform_version
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def mapToGlobal(self, obj: WorldObject, out: core_spaces.State) -> core_spaces.State:
+        """
+        Writes the global configuration of an object in the local space into out. The transform of the group is
+        composed with the local configuration in one flat product of the space
+        """
+        if type(self.local_space) is not type(out.space):
+            return out.space.map_into(obj._getConfigurationLocal(), out)
+
+        transform, _ = self.getTransform()
+        out.setArray(self.local_space._addBatch(transform, obj._getConfigurationLocal().asArray()[np.newaxis, :])[0])
+        return out
+
+    # ------------------------------------------------------------------------------------------------------------------
     def _updatePhysics(self, config, *args, **kwargs):
         pass
 
 
+# ======================================================================================================================
+class WorldRegistry:
+    """
+    Struct-of-arrays storage of the global configurations of all objects of a world. Row i of values holds the
+    configuration of objects[i] in the flat layout of the world space, and the reused global configuration State of
+    the object, see WorldObject._getConfigurationGlobal(), is a view into that row. Objects that live in the world space and are not dynamic use the row as their
+    configuration directly, all others write into it whenever their global configuration is mapped. The queries
+    refresh these rows with update() before they read the arrays.
+    Only the column and pair queries run over the arrays. World.getSample() and the physics updates are not moved
+    to the registry and still go through the objects one by one
+    """
+    space: core_spaces.Space
+    values: np.ndarray  # (capacity, space.size). Only the first len(self) rows are in use
+    objects: list['WorldObject']
+    index: dict[str, int]  # Object id -> row
+    live: np.ndarray  # True for objects whose row is their configuration and is always up to date
+    version: int  # Incremented whenever objects are added or removed, i.e. whenever the rows change meaning
+
+    def __init__(self, space: core_spaces.Space, capacity: int = 16):
+        self.space = space
+        self.values = np.zeros((capacity, self.space.size))
+        self.objects = []
+        self.index = {}
+        self.live = np.zeros(capacity, dtype=bool)
+        self.version = 0
+        self._states = []
+
+    # === METHODS ======================================================================================================
+    def add(self, obj: 'WorldObject') -> int:
+        if obj.id in self.index:
+            return self.index[obj.id]
+        if obj._configuration is None:
+            return None
+
+        row = len(self.objects)
+        if row == len(self.values):
+            self._grow()
+
+        live = obj.space is self.space and type(obj).configuration is WorldObject.configuration
+        if live:
+            state = obj._configuration
+        else:
+            state = obj._configuration_global
+            if state is None or state.space is not self.space:
+                state = self.space.getState()
+
+        state.attach(self.values[row])
+        obj._configuration_global = state
+
+        self.objects.append(obj)
+        self.index[obj.id] = row
+        self.live[row] = live
+        self._states.append(state)
+        self.version += 1
+        return row
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def remove(self, obj: 'WorldObject'):
+        row = self.index.pop(obj.id, None)
+        if row is None:
+            return
+
+        # The removed object keeps its configuration as detached copy
+        state = self._states[row]
+        state.attach(state.asArray().copy())
+
+        # The last row is moved into the gap to keep the rows dense
+        last = len(self.objects) - 1
+        if row != last:
+            self.objects[row] = self.objects[last]
+            self._states[row] = self._states[last]
+            self.live[row] = self.live[last]
+            self._states[row].attach(self.values[row])
+            self.index[self.objects[row].id] = row
+
+        self.objects.pop()
+        self._states.pop()
+        self.live[last] = False
+        self.version += 1
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def update(self):
+        """
+        Maps the configurations of all objects that are not stored in the registry directly into their rows. Their
+        rows are also refreshed whenever their global configuration is read
+        """
+        for row in np.flatnonzero(~self.live[:len(self.objects)]):
+            obj = self.objects[row]
+            if obj._configuration_global is self._states[row]:
+                # Only mapped again if the object has moved
+                obj._getConfigurationGlobal()
+            else:
+                self.space.map_into(obj._getConfigurationLocal(), self._states[row])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def get(self, name: str) -> np.ndarray:
+        # Column view of one dimension over all objects, e.g. get('pos') -> (N, 3)
+        return self.getBatch().get(name)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def getBatch(self) -> core_spaces.StateBatch:
+        # Batch over all objects that is a view into the registry. The rows are refreshed first
+        self.update()
+        return core_spaces.StateBatch(space=self.space, value=self.values[:len(self.objects)])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def getPairsInRange(self, distance: float, dimension: str = 'pos') -> list[tuple['WorldObject', 'WorldObject']]:
+        """
+        Returns all pairs of objects whose positions are at most distance apart, computed over all objects at once
+        """
+        positions = self.get(dimension)
+        if positions.ndim == 1:
+            positions = positions[:, np.newaxis]
+        difference = positions[:, np.newaxis, :] - positions[np.newaxis, :, :]
+        in_range = np.einsum('ijk,ijk->ij', difference, difference) <= distance ** 2
+        rows_i, rows_j = np.nonzero(np.triu(in_range, k=1))
+        return [(self.objects[i], self.objects[j]) for i, j in zip(rows_i, rows_j)]
+
+    # === PRIVATE METHODS ==============================================================================================
+    def _grow(self):
+        values = np.zeros((2 * len(self.values), self.space.size))
+        live = np.zeros(2 * len(self.values), dtype=bool)
+        live[:len(self.live)] = self.live
+        self.values = values
+        self.live = live
+        for row, state in enumerate(self._states):
+            state.attach(self.values[row])
+
+    # === BUILT-INS ====================================================================================================
+    def __len__(self):
+        return len(self.objects)
+
+
+# ======================================================================================================================
+class WorldSampleEncoder:
+    """
+    Encodes the configurations of all objects of a world into one packed buffer per tick, e.g. for logging or for
+    the transport to a visualization. A buffer is a header followed by the registry rows as little-endian float64.
+    The header carries the version of the schema, which has to be fetched again with getSchema() when it changes
+    """
+    header = struct.Struct('<4sIII')  # Magic, schema version, tick, number of objects
+    magic = b'WSMP'
+
+    registry: WorldRegistry
+    tick: int
+
+    def __init__(self, registry: WorldRegistry):
+        self.registry = registry
+        self.tick = 0
+
+    # === METHODS ======================================================================================================
+    def getSchema(self) -> dict:
+        return {'version': self.registry.version,
+                'space': self.registry.space.getSchema(),
+                'objects': [obj.id for obj in self.registry.objects]}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def encode(self) -> bytes:
+        self.registry.update()
+        n = len(self.registry)
+        data = self.registry.values[:n].astype(core_spaces.ENCODING_DTYPE, copy=False).tobytes()
+        header = self.header.pack(self.magic, self.registry.version, self.tick, n)
+        self.tick += 1
+        return header + data
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def decode(cls, schema: dict, data: bytes) -> dict:
+        """
+        Decodes a packed buffer into the structure of World.getSample(), with the configuration of each object
+        """
+        magic, version, tick, n = cls.header.unpack_from(data)
+        if magic != cls.magic:
+            raise Exception("Data is not an encoded world sample")
+        if version != schema['version']:
+            raise Exception(f"Sample has schema version {version}, but the given schema is version {schema['version']}")
+
+        size = schema['space']['size']
+        values = np.frombuffer(data, dtype=core_spaces.ENCODING_DTYPE, offset=cls.header.size).reshape((n, size))
+
+        sample = {'tick': tick, 'objects': {}}
+        for object_id, row in zip(schema['objects'], values):
+            sample['objects'][object_id] = {'id': object_id,
+                                            'configuration': core_spaces.decodeToDict(schema['space'], row)}
+        return sample
+
+
 # ======================================================================================================================
 class World(scheduling.ScheduledObject):
     space: core_spaces.Space
@@ -313,6 +590,9 @@ class World(scheduling.ScheduledObject):
 
         self.objects: dict[str, 'WorldObject'] = {}
         self.agents: dict[str, 'WorldObject'] = {}
+        self._object_names = collections.Counter()  # Number of objects per name, to warn about duplicates
+        self.registry = WorldRegistry(space=self.space)
+        self.sample_encoder = WorldSampleEncoder(self.registry)
         self.size = size
 
         if self.size is not None:
@@ -328,14 +608,12 @@ class World(scheduling.ScheduledObject):
             assert (isinstance(obj, WorldObject))
 
             # Check if the object already exists in  the list of objects. If so, just raise a warning and continue
-            if obj in self.objects.values():
+            if self.objects.get(obj.id) is obj:
                 logging.warning("Object already exists in world")
                 continue
 
-            for _, other in self.objects.items():
-                if obj.name == other.name:
-                    logging.warning(f"There already exists an object with name \"{obj.name}\".")
-                    break
+            if self._object_names[obj.name] > 0:
+                logging.warning(f"There already exists an object with name \"{obj.name}\".")
 
             obj.scheduling.parent = self
             obj.world = self
@@ -351,6 +629,10 @@ class World(scheduling.ScheduledObject):
 
             # Add the object to the object dictionary
             self.objects[obj.id] = obj
+            self._object_names[obj.name] += 1
+
+            # Objects that are constructed with this world are registered as soon as their configuration exists
+            self.registry.add(obj)
 
             logging.info(f"Added Object \"{obj.name}\" {type(obj)} to the world.")
 
@@ -366,8 +648,10 @@ class World(scheduling.ScheduledObject):
             assert (isinstance(obj, WorldObject))
 
             # Remove the object from the object dictionary
-            if obj in self.objects.values():
+            if self.objects.get(obj.id) is obj:
                 del (self.objects[obj.id])
+                self._object_names[obj.name] -= 1
+            self.registry.remove(obj)
 
             # TODO: Also deregister the simulation object
             self.deregisterChild(obj)
@@ -427,6 +711,18 @@ class World(scheduling.ScheduledObject):
 
         return sample
 
+    # ------------------------------------------------------------------------------------------------------------------
+    def getPackedSample(self) -> bytes:
+        """
+        Configurations of all objects as one packed buffer. Decode with WorldSampleEncoder.decode() and the schema
+        from getSampleSchema()
+        """
+        return self.sample_encoder.encode()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def getSampleSchema(self) -> dict:
+        return self.sample_encoder.getSchema()
+
     # ------------------------------------------------------------------------------------------------------------------
     def getVisualizationSample(self) -> dict:
 
@@ -490,8 +786,10 @@ class World(scheduling.ScheduledObject):
 
     def _init(self):
         # TODO: Put this in a subfunction
-        # Go over all objects and build the action tree
-        for obj_name, obj in self.objects.items():
-            for action_name, action in self.scheduling.actions.items():
-                if action_name in obj.scheduling.actions and not action_name.startswith("_"):
-                    obj.scheduling.actions[action_name].parent = action
+        # Go over all objects and build the action tree. The actions of all objects are registered in each phase in
+        # one go
+        for action_name, action in self.scheduling.actions.items():
+            if action_name.startswith("_"):
+                continue
+            action.registerAction([obj.scheduling.actions[action_name] for obj in self.objects.values() if
+                                   action_name in obj.scheduling.actions])
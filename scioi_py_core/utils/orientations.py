@@ -20,20 +20,50 @@ def rotmatFromPsi_2D(psi):
 
 
 def psiFromRotMat(rotmat):
-    q = qmt.quatFromRotMat(rotmat)
-    angles = qmt.eulerAngles(q, 'zxy', intrinsic=True)
-    assert (angles[1] < 1e-4 and angles[2] < 1e-4)
-    return angles[0]
+    return psiFromQuat(qmt.quatFromRotMat(rotmat))
 
 
 def twiprToRotMat(theta, psi):
-    q = qmt.quatFromEulerAngles(np.asarray([psi, theta, 0]), 'zyx')
-    out = qmt.quatToRotMat(q)
+    out = qmt.quatToRotMat(twiprToQuat(theta, psi))
     return out
 
 
 def twiprFromRotMat(rotmat):
-    q = qmt.quatFromRotMat(rotmat)
+    return twiprFromQuat(qmt.quatFromRotMat(rotmat))
+
+
+def quatFromPsi(psi):
+    return qmt.quatFromAngleAxis(angle=psi, axis=[0, 0, 1])
+
+
+def psiFromQuat(q):
+    angles = qmt.eulerAngles(q, 'zxy', intrinsic=True)
+    assert (np.all(angles[..., 1] < 1e-4) and np.all(angles[..., 2] < 1e-4))
+    return angles[..., 0]
+
+
+def twiprToQuat(theta, psi):
+    return qmt.quatFromEulerAngles(np.stack(np.broadcast_arrays(psi, theta, 0), axis=-1), 'zyx')
+
+
+def twiprFromQuat(q):
     angles = qmt.eulerAngles(q, 'zyx')
-    out = angles[0], angles[1]
+    out = angles[..., 0], angles[..., 1]
     return out
+
+
+def quatMultiply(q1, q2):
+    # Hamilton product of (arrays of) quaternions [w, x, y, z] without the input checks of qmt.qmult
+    q1 = np.asarray(q1)
+    q2 = np.asarray(q2)
+    w1, x1, y1, z1 = q1[..., 0], q1[..., 1], q1[..., 2], q1[..., 3]
+    w2, x2, y2, z2 = q2[..., 0], q2[..., 1], q2[..., 2], q2[..., 3]
+    return np.stack((w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+                     w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                     w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                     w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2), axis=-1)
+
+
+def quatNormalize(q):
+    q = np.asarray(q)
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)